@@ -13,7 +13,6 @@
 #   XLSX file to ~/pyprj/hrm/results/tickets/${LASTYEAR}-${LASTMONTH}
 #
 TICKETENV=py8
-TEMP=temp/clean_tickets.csv
 set -e
 if [[ "$CONDA_DEFAULT_ENV" != "$TICKETENV" ]]; then
     echo Activating ${TICKETENV}
@@ -21,8 +20,6 @@ if [[ "$CONDA_DEFAULT_ENV" != "$TICKETENV" ]]; then
     conda activate ${TICKETENV}
 fi
 pushd ~/pyprj/hrm
-mkdir -p temp
-python src/tickets/clean.py "$1" ${TEMP}
 if [ $# -eq 3 ]
 then
     LASTYEAR=$2
@@ -34,8 +31,6 @@ else
 fi
 eval OUTDIR="~/pyprj/hrm/results/tickets/${LASTYEAR}-${LASTMONTH}"
 mkdir -p ${OUTDIR}
-python src/tickets/daily.py ${TEMP} -m ${LASTMONTH} -o ${OUTDIR}
-python src/tickets/weekly.py ${TEMP} -m ${LASTMONTH} -o ${OUTDIR}
+python src/tickets/report.py "$1" -y ${LASTYEAR} -m ${LASTMONTH} -o ${OUTDIR}
 echo python src/tickets/pretty2.py ${OUTDIR} ${OUTDIR}/tickets_${LASTYEAR}-${LASTMONTH}_merged.xlsx
 python src/tickets/pretty2.py ${OUTDIR} ${OUTDIR}/tickets_${LASTYEAR}-${LASTMONTH}_merged.xlsx
-# rm $TEMP
@@ -1,5 +1,70 @@
+from collections import namedtuple
+import itertools
 import re
 
+# A range like JB021-23 or JB021/23. The second part may repeat the prefix.
+_RANGE_PATTERN = re.compile(r'''(.+?)  # prefix like "JB" or "LDHRM.2024."
+                                (\d+)  # number up to the separator
+                                [-/]   # the separator can be "-" or "/"
+                                (.*?)  # possibly a prefix on the second part
+                                (\d+)$ # the trailing number
+                                ''', flags=re.VERBOSE)
+# prefix will be everything up to the trailing number. So for:
+#   JB001 -> JB
+#   LDHRM.2023.1 -> LDHRM.2023.
+_NUMBER_PATTERN = re.compile(r'(.*?)(\d+)$')
+
+
+class IdRange(namedtuple('IdRange', ['prefix', 'start', 'stop', 'width'])):
+    """
+    The accession numbers prefix + start to prefix + stop inclusive, with the
+    number zero-padded to width digits. For example JB121-24 is
+    IdRange('JB', 121, 124, 3). The prefix never ends in a digit. A width of
+    0 means an accession number with no trailing number, which is the
+    prefix alone.
+
+    count is the number of accession numbers and "in" tests whether an
+    accession number string is in the range, without expanding it. len()
+    and iteration are those of the 4-tuple so that a list of IdRange can be
+    made into a DataFrame.
+    """
+    __slots__ = ()
+
+    @property
+    def count(self):
+        # Hides tuple.count(value), which means nothing for an IdRange.
+        return self.stop - self.start + 1
+
+    def __contains__(self, idnum):
+        if not isinstance(idnum, str) or not idnum.startswith(self.prefix):
+            return False
+        digits = idnum[len(self.prefix):]
+        if not self.width:
+            return not digits
+        if not (digits.isascii() and digits.isdigit()):
+            return False
+        n = int(digits)
+        return self.start <= n <= self.stop and f'{n:0{self.width}}' == digits
+
+    def ids(self):
+        """
+        :return: an iterator over the accession numbers in the range
+        """
+        if not self.width:
+            return iter((self.prefix,))
+        if self.start == self.stop:
+            return iter((f'{self.prefix}{self.start:0{self.width}}',))
+        template = self.prefix.replace('{', '{{').replace('}', '}}')
+        return map(f'{template}{{:0{self.width}}}'.format,
+                   range(self.start, self.stop + 1))
+
+
+def _single_range(idnum: str) -> IdRange:
+    if m := _NUMBER_PATTERN.match(idnum):
+        number = int(m[2])
+        return IdRange(m[1], number, number, len(m[2]))
+    return IdRange(idnum, 0, 0, 0)
+
 
 def _splitid(idstr: str, m: re.Match) -> (str, int, int, int):
     """
@@ -33,37 +98,37 @@ def _splitid(idstr: str, m: re.Match) -> (str, int, int, int):
     return prefix, intvariablepart, intsecondidnum, len(variablepart)
 
 
-def _expand_one_idnum(idstr: str) -> list[str]:
+def _parse_one_idnum(idstr: str) -> list:
+    """
+    :return: a list of IdRange for a range and of the accession number
+             strings otherwise, which are most common and need no IdRange to
+             be expanded
+    """
     jlist = []
     idstr = ''.join(idstr.split())  # remove all whitespace
     if '-' in idstr or '/' in idstr:  # if ID is actually a range like JB021-23
         if '&' in idstr:
             raise ValueError(f'Bad accession number list: cannot contain both'
                              f' "-" and "&": "{idstr}"')
-        if m := re.match(r'''(.+?)  # prefix like "JB" or "LDHRM.2024."
-                             (\d+)  # number up to the separator
-                             [-/]   # the separator can be "-" or "/"
-                             (.*?)  # possibly a prefix on the second part
-                             (\d+)$ # the trailing number
-                             ''', idstr, flags=re.VERBOSE):
+        if m := _RANGE_PATTERN.match(idstr):
             prefix, num1, num2, lenvariablepart = _splitid(idstr, m)
-            try:
-                for suffix in range(num1, num2 + 1):
-                    newidnum = f'{prefix}{suffix:0{lenvariablepart}}'
-                    jlist.append(newidnum)
-            except ValueError:
-                raise ValueError(f'Bad accession number, contains "-" but not '
-                                 f'well formed: {m.groups()}')
+            # Move the fixed digits, the "1" of JB1 for JB121-24, into the
+            # number so that the prefix does not end in a digit.
+            fixed = _NUMBER_PATTERN.match(prefix)
+            if fixed:
+                base = int(fixed[2]) * 10 ** lenvariablepart
+                prefix, num1, num2 = fixed[1], base + num1, base + num2
+                lenvariablepart += len(fixed[2])
+            jlist.append(IdRange(prefix, num1, num2, lenvariablepart))
         else:
             raise ValueError('Bad accession number, failed pattern match:', idstr)
     elif '&' in idstr:
         parts = idstr.split('&')
         head = parts[0]
+        m = _NUMBER_PATTERN.match(head)
+        if not m or not m[1]:
+            raise ValueError(f'Bad accession number, no prefix and number: "{idstr}"')
         jlist.append(head)
-        m = re.match(r'(.+?)(\d+)$', head)
-        # prefix will be everything up to the trailing number. So for:
-        #   JB001 -> JB
-        #   LDHRM.2023.1 -> LDHRM.2023.
         prefix = m[1]
         for tail in parts[1:]:
             if not tail.isnumeric():
@@ -76,6 +141,34 @@ def _expand_one_idnum(idstr: str) -> list[str]:
     return jlist
 
 
+def parse_idnum(idnumstr: str) -> list[IdRange]:
+    """
+    Parse an idnumstr without expanding the ranges in it.
+    :param idnumstr: (See expand_idnum)
+    :return: list of IdRange, one for each range or accession number
+    """
+    rtnlist = []
+    for idstr in idnumstr.split(','):
+        rtnlist += [_single_range(item) if isinstance(item, str) else item
+                    for item in _parse_one_idnum(idstr)]
+    return rtnlist
+
+
+def iter_idnum(idnumstr: str):
+    """
+    Like expand_idnum but return an iterator so that a long range is not
+    held in memory. The whole of idnumstr is parsed first, so a ValueError
+    is raised by this call and not during the iteration.
+    :param idnumstr: (See expand_idnum)
+    :return: an iterator over the idnums
+    """
+    items = []
+    for idstr in idnumstr.split(','):
+        items += _parse_one_idnum(idstr)
+    return itertools.chain.from_iterable(
+        (item,) if isinstance(item, str) else item.ids() for item in items)
+
+
 def expand_idnum(idnumstr: str) -> list[str]:
     """
     Expand an idnumstr to a list of idnums.
@@ -83,9 +176,206 @@ def expand_idnum(idnumstr: str) -> list[str]:
         idnumstr ::= idstr | idnumstr,idstr
     :return: list of idnums
     """
-    idstrlist = idnumstr.split(',')
     rtnlist = []
-    for idstr in idstrlist:
-        # _expand_one_idnum returns a list. Append the members of that list.
-        rtnlist += _expand_one_idnum(idstr)
+    for idstr in idnumstr.split(','):
+        for item in _parse_one_idnum(idstr):
+            if isinstance(item, str):
+                rtnlist.append(item)
+            else:
+                rtnlist.extend(item.ids())
+    return rtnlist
+
+
+def expand_idnums(idnumstrs, errors: str = 'raise') -> list:
+    """
+    Expand a column of idnumstrs, such as those in a catalogue export. Each
+    distinct idnumstr is parsed only once.
+    :param idnumstrs: an iterable of idnumstr (See expand_idnum)
+    :param errors: "raise" to raise ValueError for a bad idnumstr and
+                   TypeError for a value that is not a str, such as the NaN
+                   of an empty cell, or "coerce" to return None for either
+    :return: list of the lists of idnums, one for each idnumstr
+    """
+    if errors not in ('raise', 'coerce'):
+        raise ValueError(f'errors must be "raise" or "coerce", not "{errors}"')
+    cache = {}
+    rtnlist = []
+    for idnumstr in idnumstrs:
+        if not isinstance(idnumstr, str):
+            if errors == 'raise':
+                raise TypeError(f'idnumstr must be a str, not {idnumstr!r}')
+            rtnlist.append(None)
+            continue
+        if idnumstr not in cache:
+            try:
+                cache[idnumstr] = expand_idnum(idnumstr)
+            except ValueError:
+                if errors == 'raise':
+                    raise
+                cache[idnumstr] = None
+        idnums = cache[idnumstr]
+        # Each result is a new list, as if expand_idnum had been called.
+        rtnlist.append(None if idnums is None else list(idnums))
     return rtnlist
+
+
+def _shares_id(a: IdRange, b: IdRange) -> bool:
+    """
+    :return: True if the ranges have an accession number in common
+    """
+    if a.prefix != b.prefix:
+        return False
+    lo, hi = max(a.start, b.start), min(a.stop, b.stop)
+    if lo > hi:
+        return False
+    if a.width == b.width:
+        return True
+    if not a.width or not b.width:
+        return False
+    # JB1 and JB001 differ but JB100 may be in both JB1-100 and JB001-100.
+    return hi >= 10 ** (max(a.width, b.width) - 1)
+
+
+def _to_ranges(ids) -> list[IdRange]:
+    return [ids] if isinstance(ids, IdRange) else parse_idnum(ids)
+
+
+def _build_maxstops(entries, maxstops, lo, hi) -> int:
+    """
+    Set maxstops[mid] to the maximum stop of entries[lo:hi] where mid is the
+    middle of the slice, and the same for the slices on each side of mid.
+    :return: the maximum stop or -1 for an empty slice
+    """
+    if lo >= hi:
+        return -1
+    mid = (lo + hi) // 2
+    maxstops[mid] = max(entries[mid][0].stop,
+                        _build_maxstops(entries, maxstops, lo, mid),
+                        _build_maxstops(entries, maxstops, mid + 1, hi))
+    return maxstops[mid]
+
+
+def _search(entries, maxstops, lo, hi, query: IdRange, found: list):
+    """
+    Append to found the entries of entries[lo:hi] sharing an accession
+    number with query, in the order of their start.
+    """
+    if lo >= hi:
+        return
+    mid = (lo + hi) // 2
+    if maxstops[mid] < query.start:
+        return
+    _search(entries, maxstops, lo, mid, query, found)
+    idrange = entries[mid][0]
+    if idrange.start > query.stop:
+        return  # and so do all of the entries after it
+    if _shares_id(idrange, query):
+        found.append(entries[mid])
+    _search(entries, maxstops, mid + 1, hi, query, found)
+
+
+class IdIndex:
+    """
+    An index of accession number ranges, each with a value such as the name
+    of the file that it came from.
+
+    The ranges are kept for each prefix sorted by their start as an
+    implicit interval tree: the entry at the middle of each slice of the
+    list is the root of the tree of that slice and holds the maximum stop in
+    it. A query skips a subtree whose maximum stop is before its start and
+    the right subtree of an entry starting after its stop, so it visits
+    O((k + 1) log n) entries for k found, however long the ranges are.
+    """
+    def __init__(self, items=()):
+        """
+        :param items: iterable of (ids, value) where ids is an idnumstr or an
+                      IdRange
+        """
+        self._entries = {}  # prefix -> list of (IdRange, value)
+        self._maxstops = {}  # prefix -> list of the subtree maximum stop
+        self._dirty = False
+        for ids, value in items:
+            self.add(ids, value)
+
+    def add(self, ids, value=None):
+        for idrange in _to_ranges(ids):
+            self._entries.setdefault(idrange.prefix, []).append((idrange, value))
+        self._dirty = True
+
+    def _build(self):
+        for prefix, entries in self._entries.items():
+            entries.sort(key=lambda entry: entry[0].start)
+            maxstops = [0] * len(entries)
+            _build_maxstops(entries, maxstops, 0, len(entries))
+            self._maxstops[prefix] = maxstops
+        self._dirty = False
+
+    def _query(self, query: IdRange) -> list:
+        """
+        :return: list of the (IdRange, value) sharing an accession number
+                 with query in the order of their start
+        """
+        if self._dirty:
+            self._build()
+        entries = self._entries.get(query.prefix)
+        if not entries:
+            return []
+        found = []
+        _search(entries, self._maxstops[query.prefix], 0, len(entries),
+                query, found)
+        return found
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def __contains__(self, idnum: str) -> bool:
+        return bool(self._query(_single_range(idnum)))
+
+    def lookup(self, idnum: str) -> list:
+        """
+        :return: list of the values of the ranges containing idnum
+        """
+        return [value for _, value in self._query(_single_range(idnum))]
+
+    def overlapping(self, ids) -> list:
+        """
+        :param ids: an idnumstr or an IdRange
+        :return: list of the (IdRange, value) in the index that have an
+                 accession number in common with ids
+        """
+        found = []
+        seen = set()  # the same entry may match more than one query range
+        for query in _to_ranges(ids):
+            for entry in self._query(query):
+                if id(entry) not in seen:
+                    seen.add(id(entry))
+                    found.append(entry)
+        return found
+
+    def merged(self) -> list[IdRange]:
+        """
+        :return: list of the ranges in the index with those that overlap or
+                 are adjacent merged, for ranges with the same prefix and
+                 width, sorted by prefix, width and start
+        """
+        ranges = sorted((idrange for entries in self._entries.values()
+                         for idrange, _ in entries),
+                        key=lambda r: (r.prefix, r.width, r.start))
+        rtnlist = []
+        for idrange in ranges:
+            if rtnlist:
+                last = rtnlist[-1]
+                if (last.prefix, last.width) == (idrange.prefix, idrange.width) \
+                        and idrange.start <= last.stop + 1:
+                    if idrange.stop > last.stop:
+                        rtnlist[-1] = last._replace(stop=idrange.stop)
+                    continue
+            rtnlist.append(idrange)
+        return rtnlist
+
+
+def idnums_overlap(idnumstr1: str, idnumstr2: str) -> bool:
+    """
+    :return: True if the idnumstrs have an accession number in common
+    """
+    return bool(IdIndex([(idnumstr1, None)]).overlapping(idnumstr2))
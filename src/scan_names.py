@@ -0,0 +1,112 @@
+"""
+    Parse the filenames of the scans used by stitch_spodnoodle.py and
+    split_spodnoodle.py.
+
+    The regular expressions depend on the MDA code and the flag character
+    given on the command line. They are compiled once for each combination.
+"""
+
+import functools
+import os
+import re
+
+# Why list_images and index_stitch_sets did not use a directory entry.
+NOT_FILE, NOT_IMAGE, FAILED_PARSE = 'not file', 'not image', 'failed parse'
+
+
+@functools.lru_cache
+def stitch_patterns(mdacode: str, flagchar: str) -> (re.Pattern, re.Pattern):
+    """
+    :return: the patterns for names starting with the MDA code, like
+             LDHRM.2024.17A, and for other names, like JB146A. Each has the
+             groups "base" and "part".
+    """
+    if flagchar:
+        part = rf'(?P<part>{re.escape(flagchar)}\d+)'
+    else:
+        part = '(?P<part>[AB])'
+    return (re.compile(rf'(?P<base>{re.escape(mdacode)}\.\d+\.\d+(\.\d+)?){part}$'),
+            re.compile(rf'(?P<base>\D+\d+(\.\d+)?){part}$'))
+
+
+@functools.lru_cache
+def split_pattern(flagchar: str) -> re.Pattern:
+    return re.compile(rf'(.*)({re.escape(flagchar)}\d)$')
+
+
+def parse_stitch_name(prefix: str, mdacode: str, flagchar: str) -> (str, str):
+    """
+    :param prefix: The filename without the leading path or the extension
+    :return: 1. The filename without the part indicator (A or B)
+             2. The part indicator
+             or two empty strings if the name is not a part of a scan
+    """
+    mdapattern, pattern = stitch_patterns(mdacode, flagchar)
+    m = (mdapattern if prefix.startswith(mdacode) else pattern).match(prefix)
+    if not m:
+        return '', ''
+    return m['base'], m['part']
+
+
+def parse_split_name(prefix: str, flagchar: str) -> (str, str):
+    """
+    :param prefix: The filename without the leading path or the extension
+    :return: 1. The accession numbers, like JB160&1
+             2. The flag string, like #1
+             or None, None if the name does not end with the flag string
+    """
+    m = split_pattern(flagchar).match(prefix)
+    if not m:
+        return None, None
+    return m[1], m[2]
+
+
+def list_images(indir: str, imgexts) -> (list, list):
+    """
+    List a directory in one pass with os.scandir, which usually knows
+    whether an entry is a file without calling stat.
+
+    :return: 1. A list of (filename, prefix, extension) of the image files
+                sorted by filename
+             2. A list of (filename, reason) of the other entries, where the
+                reason is NOT_FILE or NOT_IMAGE
+    """
+    images = []
+    others = []
+    with os.scandir(indir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                others.append((entry.name, NOT_FILE))
+                continue
+            prefix, extension = os.path.splitext(entry.name)
+            if extension.lower() not in imgexts:
+                others.append((entry.name, NOT_IMAGE))
+                continue
+            images.append((entry.name, prefix, extension))
+    images.sort()
+    others.sort()
+    return images, others
+
+
+def index_stitch_sets(indir: str, imgexts, mdacode: str,
+                      flagchar: str) -> (dict, list):
+    """
+    Group the scans in a directory by the file they are to be stitched to.
+
+    :return: 1. A dict of output filename -> list of the scans' filenames in
+                the order of their parts, so that "#10" follows "#9"
+             2. A list of (filename, reason) of the entries not used, where
+                the reason is NOT_FILE, NOT_IMAGE or FAILED_PARSE
+    """
+    images, others = list_images(indir, imgexts)
+    sets = {}
+    for filename, prefix, extension in images:
+        base, part = parse_stitch_name(prefix, mdacode, flagchar)
+        if not base:
+            others.append((filename, FAILED_PARSE))
+            continue
+        partnum = int(part[len(flagchar):]) if flagchar else part
+        sets.setdefault(base + extension, []).append((partnum, filename))
+    others.sort()
+    return ({outfile: [filename for _, filename in sorted(parts)]
+             for outfile, parts in sets.items()}, others)
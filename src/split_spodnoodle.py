@@ -5,19 +5,45 @@
     <accession#1>&<accession#2>#n.jpg --> <accession#1>#n.jpg and <accession#2>#n.jpg
 
     where #n is like #1 or #2. and # is the flag character used by stitch_spodnoodle.py.
+
+    The parts of the image to write are given by --y1 and --y2 or by a --crop
+    option for each output file. Each input image is decoded once and the
+    output images are cropped from it.
+
+    With --auto, the image is split at the middle of the blank horizontal
+    gutters between the drawings. Rows are blank if almost none of their
+    pixels are darker than the paper. If the gutters are not clear, the
+    --y1 and --y2 or --crop values are used instead.
+
+    With --lossless, JPEG files are cropped by jpegtran without decoding and
+    re-encoding them, if jpegtran is installed and the top left corner of the
+    crop is on a boundary of the JPEG's blocks (MCUs). Other crops are
+    re-encoded as usual.
 """
 
 import argparse
 from colorama import Fore, Style
+from concurrent.futures import ProcessPoolExecutor
 import cv2 as cv
+import numpy as np
 import os
-import re
+import shutil
+import struct
+import subprocess
 import sys
 import time
 
-from id_utl import expand_idnum
+from id_utl import IdIndex, expand_idnum, parse_idnum
+from scan_names import list_images, parse_split_name
 
 IMGEXTS = ('.png', '.jpg', '.jpeg')
+# A row is blank if less than this fraction of its pixels is ink, which
+# allows for dust and specks.
+BLANK_FRACTION = 0.005
+# A gutter must be at least this fraction of the image height.
+MIN_GUTTER = 0.005
+JPEGEXTS = ('.jpg', '.jpeg')
+JPEGTRAN = shutil.which('jpegtran')
 
 
 
@@ -38,6 +64,15 @@ def getargs():
     ''')
     parser.add_argument('outdir', help='''
     The output directory to contain the split files. ''')
+    parser.add_argument('--auto', action='store_true', help='''
+    Find where to split each image. --y1 and --y2 or --crop are optional
+    and are used for the images where the confidence is too low. ''')
+    parser.add_argument('--crop', nargs='+', type=int, action='append',
+                        metavar='PIXEL', help='''
+    Y0 Y1 [X0 X1]: the start and limit pixels for the y-axis and optionally
+    the x-axis of an output image. The default x-axis is the full width.
+    Specify this once for each output image, in the order of the accession
+    numbers in the input filename. This replaces --y1 and --y2. ''')
     parser.add_argument('--dryrun', action='store_true', help='''
     If set, only scan the filenames but do no processing. ''')
     parser.add_argument('--flagchar', required=True, help='''
@@ -48,19 +83,59 @@ def getargs():
      system. Do not use characters used in regular expressions. Known to be safe: "=#%%". Alphabetic letters may be
      used but note that these are case sensitive.''')
     # Note % character escaped but prints normally.
+    parser.add_argument('-i', '--include', action='append', help='''
+    Only split the files with an accession number in this list, which is in
+    the form used in filenames, such as "JB121-24,JB130&2". This may be
+    repeated. ''')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='''
+    The number of worker processes. Each process splits one input file at a
+    time. The default is 1. Specify 0 to use one process per CPU. ''')
+    parser.add_argument('--lossless', action='store_true', help='''
+    Crop JPEG files with jpegtran, keeping the original compressed data and
+    metadata, when the top left corner of the crop allows it. With --auto,
+    the split is moved within the gutter to allow it where possible. Note
+    that the crop is of the stored image, so this is not suitable for files
+    that are rotated by their EXIF orientation. ''')
+    parser.add_argument('--min-confidence', type=float, default=0.5,
+                        help='''
+    With --auto, the confidence from 0 to 1 below which the split found is
+    not used. The default is 0.5. ''')
     parser.add_argument('--mdacode', default='LDHRM', help='''
     The MDA code that prepends some accession numbers. ''')
     parser.add_argument('--overwrite', action='store_true', help='''
     If not set, only the new scans will be processed. ''')
     parser.add_argument('-v', '--verbose', type=int, default=1, help='''
         Set the verbosity. The default is 1 which prints summary information. ''')
-    parser.add_argument('--y1', nargs=2, type=int, required=True, help='''
+    parser.add_argument('--y1', nargs=2, type=int, help='''
     The start and limit pixels for the y-axis of the first image.''')
-    parser.add_argument('--y2', nargs=2, type=int, required=True, help='''
+    parser.add_argument('--y2', nargs=2, type=int, help='''
     The start and limit pixels for the y-axis of the second image.''')
 
 
     args = parser.parse_args()
+    if args.jobs == 0:
+        args.jobs = os.cpu_count()
+    for ids in args.include or ():
+        try:
+            parse_idnum(ids)
+        except ValueError as e:
+            parser.error(f'Bad --include "{ids}": {e}')
+    # args.crops is a list of (y0, y1, x0, x1) with x1 None for the full width
+    # or None if there are no manual values for --auto to fall back on.
+    if args.crop:
+        if args.y1 or args.y2:
+            parser.error('--crop cannot be used with --y1 or --y2.')
+        for crop in args.crop:
+            if len(crop) not in (2, 4):
+                parser.error(f'--crop needs 2 or 4 values, not {crop}.')
+        args.crops = [tuple(crop) if len(crop) == 4 else (*crop, 0, None)
+                      for crop in args.crop]
+    elif args.y1 and args.y2:
+        args.crops = [(*args.y1, 0, None), (*args.y2, 0, None)]
+    elif args.auto:
+        args.crops = None
+    else:
+        parser.error('Specify --y1 and --y2 or --crop or --auto.')
     return args
 
 
@@ -72,15 +147,14 @@ def parse_filename(prefix) -> (list, int):
     """
     # Split off the flag string
     #
-    m = re.match(rf'(.*)({flagchar}\d)$', prefix)
-    if not m:
+    names, flag = parse_split_name(prefix, flagchar)
+    if names is None:
         return None, 1
-    names, flag = m[1], m[2]
     try:
         names = expand_idnum(names)
     except ValueError:
         return None, 2
-    if len(names) != 2:
+    if len(names) != (len(_args.crops) if _args.crops else 2):
         return None, 3
     return [n + flag for n in names], 0
 
@@ -89,46 +163,264 @@ def s(i: int):
     return '' if i == 1 else 's'
 
 
-def main():
-    t1 = time.perf_counter()
-    nwritten = 0
-    for filename in sorted(os.listdir(indir)):
-        inpath = os.path.join(indir, filename)
-        trace(2, 'inpath={}', inpath)
-        if not os.path.isfile(inpath):
-            trace(1, 'Skipping not file {}', filename, color=Fore.YELLOW)
+def find_gutters(img, nparts, align=1):
+    """
+    Find the nparts - 1 widest runs of blank rows that are not at the top or
+    bottom of the image. The image is split at the middle of each gutter or
+    at the multiple of align nearest to the middle if it is in the gutter.
+
+    The confidence is 0 if there are too few gutters or one is narrower than
+    MIN_GUTTER and otherwise 1 less the ratio of the widest gutter not used
+    to the narrowest gutter used, so it is 1 if there is no other gutter.
+
+    :return: a 2-tuple of the crops, split at the middle of each gutter, or
+             None and the confidence
+    """
+    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    height = gray.shape[0]
+    # Otsu's method separates the ink from the paper.
+    _, ink = cv.threshold(gray, 0, 1, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
+    blank = ink.mean(axis=1) < BLANK_FRACTION
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], blank, [0]))
+                                   .astype(np.int8)))
+    starts, stops = edges[::2], edges[1::2]
+    inside = (starts > 0) & (stops < height)
+    starts, stops = starts[inside], stops[inside]
+    widths = stops - starts
+    if len(widths) < nparts - 1:
+        return None, 0.
+    order = np.argsort(widths)[::-1]
+    used, unused = order[:nparts - 1], order[nparts - 1:]
+    narrowest = widths[used].min()
+    if narrowest < MIN_GUTTER * height:
+        return None, 0.
+    confidence = 1 - (widths[unused].max() / narrowest if len(unused) else 0)
+    splits = []
+    for i in used:
+        middle = (starts[i] + stops[i]) // 2
+        aligned = round(middle / align) * align
+        splits.append(aligned if starts[i] <= aligned < stops[i] else middle)
+    ys = [0] + [int(y) for y in sorted(splits)] + [height]
+    return [(ys[n], ys[n + 1], 0, None) for n in range(nparts)], confidence
+
+
+def jpeg_geometry(path):
+    """
+    Read the JPEG markers up to the start of frame.
+
+    :return: a 4-tuple of the width, height, MCU width and MCU height or None
+             if the file is not a JPEG file that can be read
+    """
+    with open(path, 'rb') as f:
+        try:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                while marker[1] == 0xFF:  # fill bytes
+                    marker = marker[1:] + f.read(1)
+                code = marker[1]
+                if code == 0x01 or 0xD0 <= code <= 0xD8:  # no segment
+                    continue
+                if code in (0xD9, 0xDA):  # end of image or start of scan
+                    return None
+                length = struct.unpack('>H', f.read(2))[0]
+                # SOF0 to SOF15 except DHT, JPG and DAC
+                if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                    data = f.read(length - 2)
+                    if len(data) < length - 2:
+                        return None
+                    _, height, width, ncomp = struct.unpack('>BHHB', data[:6])
+                    if ncomp == 1:
+                        # A single component is not interleaved.
+                        return width, height, 8, 8
+                    factors = data[7:6 + 3 * ncomp:3]
+                    return (width, height, 8 * max(b >> 4 for b in factors),
+                            8 * max(b & 0x0F for b in factors))
+                f.seek(length - 2, os.SEEK_CUR)
+        except (struct.error, IndexError, ValueError):
+            # Truncated in the markers or the start of frame segment
+            return None
+
+
+def lossless_crop(inpath, outpath, crop, geometry):
+    """
+    Crop a JPEG file with jpegtran if the crop's origin is on an MCU
+    boundary.
+
+    :return: True if the file was written
+    """
+    y_orig, y_lim, x_orig, x_lim = crop
+    width, height, mcu_width, mcu_height = geometry
+    if x_orig % mcu_width or y_orig % mcu_height:
+        trace(2, '{} is not MCU aligned ({}x{})', crop, mcu_width, mcu_height)
+        return False
+    w = min(width if x_lim is None else x_lim, width) - x_orig
+    h = min(y_lim, height) - y_orig
+    if w <= 0 or h <= 0:
+        return False  # reported by split_file
+    head, tail = os.path.split(outpath)
+    temppath = os.path.join(head, f'.{tail}.{os.getpid()}.tmp')
+    cmd = [JPEGTRAN, '-copy', 'all', '-crop', f'{w}x{h}+{x_orig}+{y_orig}',
+           '-outfile', temppath, inpath]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode:
+        trace(1, 'jpegtran failed: {}', result.stderr.strip(), color=Fore.YELLOW)
+        if os.path.exists(temppath):
+            os.remove(temppath)
+        return False
+    os.replace(temppath, outpath)
+    return True
+
+
+def split_file(filename, files):
+    """
+    Decode one input image and write the crops of it, or with --lossless
+    crop it with jpegtran where possible. This may be run in a worker
+    process. It never raises so that one bad image does not stop the others.
+
+    :param filename: the input file name
+    :param files: the output file names without the extension, one for each
+                  crop
+    :return: a 3-tuple of filename, the number of files written and an error
+             message or None
+    """
+    try:
+        return split_image(filename, files)
+    except Exception as e:  # keep going with the other images
+        return filename, 0, f'Failed to split {filename}: {type(e).__name__}: {e}'
+
+
+def split_image(filename, files):
+    """
+    The body of split_file, which may raise.
+
+    :return: see split_file
+    """
+    inpath = os.path.join(indir, filename)
+    extension = os.path.splitext(filename)[1]
+    outpaths = [os.path.join(outdir, f + extension) for f in files]
+    todo = []
+    for n, outpath in enumerate(outpaths):
+        if not _args.overwrite and os.path.exists(outpath):
+            trace(2, 'Skipping already processed file: {}', outpath)
             continue
-        prefix, extension = os.path.splitext(filename)
-        if extension.lower() not in IMGEXTS:
-            trace(1, 'Skipping not image {}', filename, color=Fore.YELLOW)
+        todo.append(n)
+    if not todo:
+        return filename, 0, None
+    geometry = None
+    if _args.lossless and JPEGTRAN and extension.lower() in JPEGEXTS:
+        geometry = jpeg_geometry(inpath)
+    inimg = None
+    crops = _args.crops
+    if _args.auto:
+        inimg = cv.imread(inpath)
+        if inimg is None:
+            return filename, 0, f"can't read image {filename}"
+        found, confidence = find_gutters(inimg, len(files),
+                                         geometry[3] if geometry else 1)
+        if found and confidence >= _args.min_confidence:
+            trace(2, '{}: split at {}, confidence {:.2f}', filename,
+                  [crop[0] for crop in found[1:]], confidence)
+            crops = found
+        elif crops:
+            trace(1, '{}: confidence {:.2f}, using the manual values',
+                  filename, confidence, color=Fore.YELLOW)
+        else:
+            return filename, 0, f'No split found for {filename}, confidence {confidence:.2f}'
+    nwritten = 0
+    for n in todo:
+        outpath = outpaths[n]
+        if geometry and lossless_crop(inpath, outpath, crops[n], geometry):
+            trace(2, 'outpath={} (lossless)', outpath)
+            nwritten += 1
             continue
+        if inimg is None:
+            inimg = cv.imread(inpath)
+            if inimg is None:
+                return filename, nwritten, f"can't read image {filename}"
+            trace(2, 'height={}, width={}', *inimg.shape[:2])
+        height, width, _ = inimg.shape
+        y_orig, y_lim, x_orig, x_lim = crops[n]
+        # a view of inimg, not a copy
+        outimg = inimg[y_orig:y_lim, x_orig:x_lim]
+        if outimg.size == 0:
+            return filename, nwritten, f'Empty crop {y_orig, y_lim, x_orig, x_lim} of {filename} ({width}x{height})'
+        trace(2, 'outpath={}', outpath)
+        if not cv.imwrite(outpath, outimg):
+            return filename, nwritten, f"can't write {outpath}"
+        nwritten += 1
+    return filename, nwritten, None
+
+
+def init_worker(args):
+    """
+    Initialize a worker process. With the "spawn" start method (the default
+    on macOS) the globals set in __main__ are not inherited.
+    """
+    global _args, indir, outdir, flagchar
+    _args = args
+    indir, outdir, flagchar = args.indir, args.outdir, args.flagchar
+
+
+def report(results):
+    """
+    :param results: iterable of the 3-tuples returned by split_file
+    :return: a 2-tuple of the number of files written and the number of
+             input files that failed
+    """
+    nwritten = nfailed = 0
+    for filename, n, error in results:
+        nwritten += n
+        if error:
+            nfailed += 1
+            trace(1, '{}', error, color=Fore.MAGENTA)
+    return nwritten, nfailed
+
+
+def main():
+    t1 = time.perf_counter()
+    jobs = {}
+    include = None
+    if _args.include:
+        include = IdIndex((ids, None) for ids in _args.include)
+    images, others = list_images(indir, IMGEXTS)
+    for filename, reason in others:
+        trace(1, 'Skipping {} {}', reason, filename, color=Fore.YELLOW)
+    for filename, prefix, extension in images:
         files, status = parse_filename(prefix)
         if status:
             trace(1, 'Failed parse: {}, error: {}', filename, status, color=Fore.MAGENTA)
             continue
         trace(2, 'input filename="{}", files="{}", extension="{}"', filename, files, extension)
-        if _args.dryrun:
+        if include and not any(f.rpartition(flagchar)[0] in include
+                               for f in files):
+            trace(2, 'Not included: {}', filename)
             continue
-        pixel_y = [_args.y1, _args.y2]
-        for n in range(2):
-            y_orig, y_lim = pixel_y[n]
-            outfile = files[n] + extension
-            outpath = os.path.join(_args.outdir, outfile)
-            trace(2, 'outpath={}, type={}', outpath, type(outpath))
-            if not _args.overwrite and os.path.exists(outpath):
-                trace(2, 'Skipping already processed file: {}', outfile)
-                continue
-            inimg = cv.imread(inpath)
-            height, width, _ = inimg.shape
-            trace(2,'height={}, width={}', height, width)
-            outimg = inimg[y_orig:y_lim, 0:width]
-            if _args.dryrun:
-                continue
-            cv.imwrite(str(outpath), outimg)
-            nwritten += 1
+        jobs[filename] = files
+    if _args.dryrun:
+        return
+    if _args.lossless and not JPEGTRAN:
+        trace(1, 'jpegtran not found, --lossless is ignored.', color=Fore.YELLOW)
+
+    if _args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=_args.jobs,
+                                 initializer=init_worker,
+                                 initargs=(_args,)) as executor:
+            nwritten, nfailed = report(
+                executor.map(split_file, jobs, jobs.values()))
+    else:
+        init_worker(_args)
+        nwritten, nfailed = report(
+            split_file(filename, jobs[filename]) for filename in jobs)
 
     elapsed = time.perf_counter() - t1
     trace(1, f'Elapsed: {elapsed:6.3f} seconds. {nwritten} file{s(nwritten)} written.')
+    if nfailed:
+        trace(1, '{} failed.', nfailed)
+    return 1 if nfailed else 0
 
 if __name__ == '__main__':
     assert sys.version_info >= (3, 13)
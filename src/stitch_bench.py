@@ -0,0 +1,184 @@
+"""
+    Benchmark the stitcher settings of stitch_spodnoodle.py.
+
+    Each pair of scans in the input directory is stitched with each of the
+    settings given. A setting is the registration, seam estimation and
+    compositing resolutions in megapixels, separated by commas, see the
+    --registration, --seam and --compositing options of stitch_spodnoodle.py.
+    -1 means the resolution of the scans.
+
+    Each stitch is run in a new process so that its peak memory can be
+    measured. The quality of each result is given as the PSNR in dB compared
+    with the result of the first setting.
+"""
+
+import argparse
+from colorama import Fore, Style
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import resource
+import sys
+import time
+
+import cv2 as cv
+
+from scan_names import index_stitch_sets
+import stitch_spodnoodle
+
+# The first is the stitcher's default and the reference for the PSNR.
+SETTINGS = ('0.6,0.1,-1', '0.3,0.1,-1', '0.15,0.05,-1', '0.6,0.1,2')
+
+
+def trace(level, template, *args, color=None):
+    if _args.verbose >= level:
+        if color:
+            print(f'{color}{template.format(*args)}{Style.RESET_ALL}')
+        else:
+            print(template.format(*args))
+
+
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes.
+    return maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def parse_setting(setting):
+    """
+    :return: the registration, seam and compositing resolutions
+    """
+    registration, seam, compositing = (float(v) for v in setting.split(','))
+    return registration, seam, compositing
+
+
+def find_pairs():
+    """
+    :return: dict of output file name -> list of the two scan file names
+    """
+    scans, _ = index_stitch_sets(_args.indir, stitch_spodnoodle.IMGEXTS,
+                                 _args.mdacode, _args.flagchar)
+    return {k: v for k, v in scans.items() if len(v) == 2}
+
+
+def stitch_pair(infiles, setting):
+    """
+    Run in a new process.
+
+    :return: a 3-tuple of the stitched image or None, the seconds taken to
+             stitch and the peak RSS in megabytes
+    """
+    args = argparse.Namespace(**vars(_args))
+    args.registration, args.seam, args.compositing = parse_setting(setting)
+    stitch_spodnoodle.init_worker(args)
+    imgs = [cv.imread(os.path.join(_args.indir, f)) for f in infiles]
+    t = time.perf_counter()
+    _, pano = stitch_spodnoodle.stitch_one(imgs)
+    elapsed = time.perf_counter() - t
+    return pano, elapsed, peak_rss_mb()
+
+
+def init_worker(args):
+    global _args
+    _args = args
+
+
+def psnr(pano, reference):
+    if pano.shape != reference.shape:
+        pano = cv.resize(pano, reference.shape[1::-1],
+                         interpolation=cv.INTER_AREA)
+    return cv.PSNR(reference, pano)
+
+
+def main():
+    pairs = find_pairs()
+    trace(1, '{} pairs found.', len(pairs))
+    results = []
+    # max_tasks_per_child gives each stitch a fresh process.
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1,
+                             initializer=init_worker,
+                             initargs=(_args,)) as executor:
+        for outfile, infiles in pairs.items():
+            reference = None
+            for setting in _args.settings:
+                pano, elapsed, rss = executor.submit(stitch_pair, infiles,
+                                                     setting).result()
+                result = dict(file=outfile, setting=setting,
+                              seconds=round(elapsed, 3),
+                              peak_rss_mb=round(rss, 1))
+                if pano is None:
+                    trace(1, '{:24} {:14} failed', outfile, setting,
+                          color=Fore.MAGENTA)
+                    result['failed'] = True
+                    results.append(result)
+                    continue
+                if reference is None and setting == _args.settings[0]:
+                    reference = pano
+                result['psnr'] = (round(psnr(pano, reference), 2)
+                                  if reference is not None else None)
+                results.append(result)
+                trace(1, '{:24} {:14} {:7.3f}s {:8.1f} MB  PSNR {}', outfile,
+                      setting, elapsed, rss, result['psnr'])
+    summary = {}
+    for setting in _args.settings:
+        ok = [r for r in results if r['setting'] == setting
+              and not r.get('failed')]
+        psnrs = [r['psnr'] for r in ok if r['psnr'] is not None]
+        summary[setting] = dict(
+            failed=sum(1 for r in results if r['setting'] == setting
+                       and r.get('failed')),
+            seconds=round(sum(r['seconds'] for r in ok), 3),
+            max_rss_mb=max((r['peak_rss_mb'] for r in ok), default=None),
+            mean_psnr=round(sum(psnrs) / len(psnrs), 2) if psnrs else None)
+        trace(1, '{:14} total {:8.3f}s  max RSS {} MB  mean PSNR {}  failed {}',
+              setting, summary[setting]['seconds'],
+              summary[setting]['max_rss_mb'], summary[setting]['mean_psnr'],
+              summary[setting]['failed'])
+    if _args.json:
+        with open(_args.json, 'w') as f:
+            json.dump(dict(opencv=cv.__version__, mode=_args.mode,
+                           summary=summary, results=results), f, indent=2)
+        trace(1, 'Written: {}', _args.json)
+    return 0
+
+
+def getargs():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('indir', help='''
+    The directory containing the scans, named as for stitch_spodnoodle.py.''')
+    parser.add_argument('--flagchar', help='''
+    See stitch_spodnoodle.py.''')
+    parser.add_argument('-j', '--json', help='''
+    File to write the results to as JSON.''')
+    parser.add_argument('--mdacode', default='LDHRM', help='''
+    The MDA code that prepends some accession numbers.''')
+    parser.add_argument('--mode', type=int, choices=stitch_spodnoodle.MODES,
+                        default=cv.Stitcher_SCANS, help='''
+    See stitch_spodnoodle.py.''')
+    parser.add_argument('-s', '--settings', nargs='+', default=SETTINGS,
+                        help=f'''
+    The settings to compare, each as REGISTRATION,SEAM,COMPOSITING. The
+    default is {' '.join(SETTINGS)}.''')
+    parser.add_argument('--threads', type=int, help='''
+    The number of threads that OpenCV may use. The default is OpenCV's.''')
+    parser.add_argument('-v', '--verbose', type=int, default=1, help='''
+    Set the verbosity. The default is 1 which prints summary information.''')
+    args = parser.parse_args()
+    for setting in args.settings:
+        try:
+            parse_setting(setting)
+        except ValueError:
+            parser.error(f'Bad setting: {setting}')
+    # used by the stitch_spodnoodle module, see stitch_spodnoodle.init_worker
+    args.outdir = None
+    args.offset = None
+    return args
+
+
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 13)
+    if len(sys.argv) == 1:
+        sys.argv.append('-h')
+    _args = getargs()
+    stitch_spodnoodle.init_worker(_args)
+    sys.exit(main())
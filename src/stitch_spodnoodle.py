@@ -5,19 +5,61 @@
 
     For example, files JB146A.jpg and JB146B.jpg in the input directory will be merged
     to file JB146.jpg in the output directory.
+
+    With --flagchar, an image may be scanned in more than two parts. The parts
+    are joined in the order of their numbers, each part to the image made
+    from the parts before it.
+
+    With --fastpath or --offset, each part is joined by a simple translation
+    relative to the part before it, which is much faster than the full
+    stitcher. The offset is checked for each part by phase correlation of the
+    overlapping area and the full stitcher is used if the check fails.
+
+    Each stitch is recorded in the journal file, .stitch_journal.jsonl, in the
+    output directory. A set of scans is stitched again only if its scans
+    have changed or it has no output file. A set that failed to stitch is
+    not tried again unless its scans change or --retry-failed is given.
 """
 
 import argparse
 from collections import defaultdict
 from colorama import Fore, Style
+from concurrent.futures import ProcessPoolExecutor
 import cv2 as cv
+import hashlib
+import json
+import numpy as np
 import os
-import re
 import sys
 import time
 
+from scan_names import FAILED_PARSE, index_stitch_sets
+
 IMGEXTS = ('.png', '.jpg', '.jpeg')
 MODES = (cv.Stitcher_PANORAMA, cv.Stitcher_SCANS)
+# The results of stitch_file.
+WRITTEN, FAILED, SKIPPED = 'written', 'failed', 'skipped'
+# Sets of scans that failed before and are not tried again.
+QUARANTINED = 'quarantined'
+JOURNAL = '.stitch_journal.jsonl'
+
+# The fast path. The scans are reduced by LEARN_SCALE to find them in the
+# panoramas made by the stitcher. A match scoring less than LEARN_MIN_SCORE is
+# not used to learn the offset. The phase correlation check uses at most
+# PHASE_SIZE x PHASE_SIZE pixels of the overlap and fails if the response is
+# less than PHASE_MIN_RESPONSE or the correction is more than PHASE_MAX_SHIFT
+# pixels.
+LEARN_SCALE = 0.25
+LEARN_MIN_SCORE = 0.9
+PHASE_SIZE = 1024
+PHASE_MIN_RESPONSE = 0.3
+PHASE_MAX_SHIFT = 64
+
+_stitcher = None  # created by stitch_one and reused for every pair
+# part number -> (dx, dy) of the part relative to the part before it. The
+# parts are numbered from 0 so the offset of the B scan is _offsets[1].
+_offsets = {}
+_learned = defaultdict(list)  # part number -> offsets found by learn_offset
 
 
 def trace(level, template, *args, color=None):
@@ -41,17 +83,35 @@ def getargs():
     parser.add_argument('outdir', help='''
     the output directory to contain the stitched files.
     ''')
+    parser.add_argument('--compositing', type=float, metavar='MPX', help='''
+    The resolution in megapixels at which the stitcher composites the
+    result. The default is the stitcher's, -1, which means the resolution of
+    the scans.
+    ''')
     parser.add_argument('--dryrun', action='store_true', help='''
     If set, only scan the filenames but do no processing. 
     ''')
+    parser.add_argument('--fastpath', type=int, default=0, metavar='N',
+                        help='''
+    Learn the offset of the B scan relative to the A scan from the first N
+    pairs joined by the full stitcher and then join the remaining pairs by
+    translation. With more than two parts, the offset of each part relative
+    to the part before it is learned separately. With --jobs, each process
+    learns the offsets from its own first N sets of scans. The default, 0,
+    disables this unless --offset is given.
+    ''')
     parser.add_argument('--flagchar', help='''
     If specified, then instead of a pattern of [AB] being the part indicator, this character
     will specify the file part to stitch, the part indicated by the digit following the character.
     For example, --flagchar="#" means that a trailing "#1" and "#2" are expected (for two files to stitch)
-     Additional files may be specified, up to "#9". The most convenient flag character may vary by operating
+     Additional files may be specified, "#3" and so on. The most convenient flag character may vary by operating
      system. Do not use characters used in regular expressions. Known to be safe: "=#%%". Alphabetic letters may be
      used but note that these are case sensitive.''')
     # Note % character escaped but prints normally.
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='''
+    The number of worker processes. Each process stitches one set of scans at
+    a time. The default is 1. Specify 0 to use one process per CPU.
+    ''')
     parser.add_argument('--mdacode', default='LDHRM', help='''
     The MDA code that prepends some accession numbers.
     ''')
@@ -61,49 +121,436 @@ def getargs():
                              mode suitable for stitching materials under affine transformation, such as scans.
                              Option `PANORAMA` ({cv.Stitcher_PANORAMA}) is suitable for creating photo panoramas.
                              ''')
+    parser.add_argument('--offset', type=int, nargs=2, metavar=('DX', 'DY'),
+                        help='''
+    The offset in pixels of the top left corner of the B scan relative to
+    the top left corner of the A scan, or of each part relative to the part
+    before it. If given, all parts are joined by translation, checked as for
+    --fastpath.
+    ''')
     parser.add_argument('--overwrite', action='store_true', help='''
-    If not set, only the new scans will be processed.
+    If not set, only the new or changed scans will be processed. Sets of
+    scans that failed are not tried again even if this is set, see
+    --retry-failed.
+    ''')
+    parser.add_argument('--registration', type=float, metavar='MPX', help='''
+    The resolution in megapixels of the copies of the scans on which the
+    stitcher finds and matches features. The default is the stitcher's, 0.6.
+    Smaller values are faster and use less memory but may fail to match.
+    See stitch_bench.py.
+    ''')
+    parser.add_argument('--retry-failed', action='store_true', help='''
+    Try again to stitch the sets of scans that the journal records as
+    failed although their scans have not changed.
+    ''')
+    parser.add_argument('--seam', type=float, metavar='MPX', help='''
+    The resolution in megapixels at which the stitcher finds the seam
+    between the scans. The default is the stitcher's, 0.1.
+    ''')
+    parser.add_argument('--threads', type=int, help='''
+    The number of threads that OpenCV may use in each process. The default
+    with --jobs is the number of CPUs divided by the number of jobs, so
+    that the processes do not compete for the CPUs. Otherwise it is
+    OpenCV's default.
     ''')
     parser.add_argument('-v', '--verbose', type=int, default=1, help='''
         Set the verbosity. The default is 1 which prints summary information.
         ''')
     args = parser.parse_args()
+    if args.jobs == 0:
+        args.jobs = os.cpu_count()
+    if args.threads is None and args.jobs > 1:
+        args.threads = max(1, os.cpu_count() // args.jobs)
     return args
 
 
-def parse_filename(prefix) -> (str, str):
+def stitch_one(imgs):
+    global _stitcher
+    if _stitcher is None:
+        _stitcher = cv.Stitcher.create(_args.mode)
+        if _args.registration:
+            _stitcher.setRegistrationResol(_args.registration)
+        if _args.seam:
+            _stitcher.setSeamEstimationResol(_args.seam)
+        if _args.compositing:
+            _stitcher.setCompositingResol(_args.compositing)
+    status, pano = _stitcher.stitch(imgs)
+    if status != cv.Stitcher_OK:
+        trace(0, "Can't stitch images, error code = {}", status, color=Fore.RED)
+        return status, None
+    return status, pano
+
+
+def to_gray(img):
+    return cv.cvtColor(img, cv.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+
+def locate(img, pano):
+    """
+    Find where the central part of a scan is in the panorama, using reduced
+    copies of both.
+
+    :return: the match score and the (x, y) of the scan's top left corner in
+             the panorama
+    """
+    small = cv.resize(to_gray(img), None, fx=LEARN_SCALE, fy=LEARN_SCALE,
+                      interpolation=cv.INTER_AREA)
+    h, w = small.shape
+    # The stitcher may have cropped the edges so match the middle only.
+    patch = small[h // 4:h - h // 4, w // 4:w - w // 4]
+    result = cv.matchTemplate(pano, patch, cv.TM_CCOEFF_NORMED)
+    _, score, _, (x, y) = cv.minMaxLoc(result)
+    return score, ((x - w // 4) / LEARN_SCALE, (y - h // 4) / LEARN_SCALE)
+
+
+def learn_offset(imgs, n, pano):
     """
-    :param prefix: The filename without the leading path or the extension
-    :return: 1. The filename without the part indicator (A or B)
-             2. The part indicator
+    Find where parts n - 1 and n are in a panorama made by the stitcher.
+    With --fastpath, the offset of part n relative to part n - 1 is learned.
+    When --fastpath offsets have been found, their median becomes the offset
+    used by stitch_parts.
+
+    :return: the (x, y) of part n in the panorama or None if it is not found
     """
-    if prefix.startswith(_args.mdacode):
-        # print(f'{prefix=}')
-        # matchstring = rf'({_args.mdacode}\.\d+\.\d+(\.\d+)?)[AB]$'
-        # print(f'{matchstring=}')
-        if flagchar:
-            # print(f'{prefix=}, {flagchar=}')
-            m = re.match(rf'(?P<base>{_args.mdacode}\.\d+\.\d+(\.\d+)?)(?P<part>{flagchar}\d+)$', prefix)
+    small = cv.resize(to_gray(pano), None, fx=LEARN_SCALE, fy=LEARN_SCALE,
+                      interpolation=cv.INTER_AREA)
+    score_b, (xb, yb) = locate(imgs[n], small)
+    if score_b < LEARN_MIN_SCORE:
+        trace(2, 'Part {} not found, match score {:.3f}', n, score_b)
+        return None
+    if _args.fastpath and n not in _offsets:
+        score_a, (xa, ya) = locate(imgs[n - 1], small)
+        if score_a < LEARN_MIN_SCORE:
+            trace(2, 'Not learning from match score {:.3f}', score_a)
         else:
-            m = re.match(rf'(?P<base>{_args.mdacode}\.\d+\.\d+(\.\d+)?)(?P<part>[AB])$', prefix)
-        # print(f'{m=}')
-    else:
-        if flagchar:
-            m = re.match(rf'(?P<base>\D+\d+(\.\d+)?)(?P<part>{flagchar}\d+)$', prefix)
+            _learned[n].append((round(xb - xa), round(yb - ya)))
+            trace(2, 'Learned offset {} for part {}', _learned[n][-1], n)
+            if len(_learned[n]) >= _args.fastpath:
+                _offsets[n] = tuple(int(v) for v in
+                                    np.median(_learned[n], axis=0))
+                trace(1, 'Fast path offset for part {}: {}', n, _offsets[n])
+    return round(xb), round(yb)
+
+
+def check_offset(imga, imgb, offset):
+    """
+    Compare the area where the scans overlap by phase correlation.
+
+    :return: the corrected offset or None if the check fails
+    """
+    dx, dy = offset
+    ha, wa = imga.shape[:2]
+    hb, wb = imgb.shape[:2]
+    # the overlap in the A scan's coordinates
+    x0, y0 = max(0, dx), max(0, dy)
+    x1, y1 = min(wa, dx + wb), min(ha, dy + hb)
+    if x1 - x0 < 2 * PHASE_MAX_SHIFT or y1 - y0 < 2 * PHASE_MAX_SHIFT:
+        trace(2, 'Overlap too small: {}x{}', x1 - x0, y1 - y0)
+        return None
+    # Use the middle of the overlap, no larger than PHASE_SIZE square.
+    if x1 - x0 > PHASE_SIZE:
+        x0 = (x0 + x1 - PHASE_SIZE) // 2
+        x1 = x0 + PHASE_SIZE
+    if y1 - y0 > PHASE_SIZE:
+        y0 = (y0 + y1 - PHASE_SIZE) // 2
+        y1 = y0 + PHASE_SIZE
+    a = np.float32(to_gray(imga[y0:y1, x0:x1]))
+    b = np.float32(to_gray(imgb[y0 - dy:y1 - dy, x0 - dx:x1 - dx]))
+    window = cv.createHanningWindow((x1 - x0, y1 - y0), cv.CV_32F)
+    (sx, sy), response = cv.phaseCorrelate(a, b, window)
+    trace(2, 'Phase correlation shift ({:.1f}, {:.1f}), response {:.3f}', sx,
+          sy, response)
+    if response < PHASE_MIN_RESPONSE or max(abs(sx), abs(sy)) > PHASE_MAX_SHIFT:
+        return None
+    return dx - round(sx), dy - round(sy)
+
+
+def compose(pano, img, x, y):
+    """
+    Place img with its top left corner at (x, y) in pano, enlarging pano as
+    needed. img is on top where they overlap.
+
+    :return: the new panorama and the (x, y) of pano's origin in it
+    """
+    h, w = pano.shape[:2]
+    hi, wi = img.shape[:2]
+    left, top = min(0, x), min(0, y)
+    right, bottom = max(w, x + wi), max(h, y + hi)
+    new = np.zeros((bottom - top, right - left) + pano.shape[2:], pano.dtype)
+    new[-top:h - top, -left:w - left] = pano
+    new[y - top:y - top + hi, x - left:x - left + wi] = img
+    return new, (-left, -top)
+
+
+def part_offset(n):
+    """
+    :return: the offset of part n relative to part n - 1 or None if there is
+             none yet
+    """
+    if n in _offsets:
+        return _offsets[n]
+    return tuple(_args.offset) if _args.offset else None
+
+
+def stitch_parts(outfile, imgs):
+    """
+    Join the parts one at a time to the panorama made from the parts before
+    it, by translation if there is an offset for the part that passes
+    check_offset and otherwise by the stitcher.
+
+    :return: a 4-tuple of the panorama or None, the stitcher's error code,
+             the list of seconds taken to join each part and the set of
+             methods used
+    """
+    pano = imgs[0]
+    pos = (0, 0)  # of the last part joined in pano, None if not known
+    seconds = []
+    methods = set()
+    for n in range(1, len(imgs)):
+        t = time.perf_counter()
+        offset = part_offset(n) if pos else None
+        if offset:
+            offset = check_offset(imgs[n - 1], imgs[n], offset)
+            if offset is None:
+                trace(1, 'Fast path check failed for {} part {}', outfile, n,
+                      color=Fore.YELLOW)
+        if offset:
+            pano, (ox, oy) = compose(pano, imgs[n], pos[0] + offset[0],
+                                     pos[1] + offset[1])
+            pos = pos[0] + offset[0] + ox, pos[1] + offset[1] + oy
+            methods.add('fast path')
         else:
-            m = re.match(rf'(?P<base>\D+\d+(\.\d+)?)(?P<part>[AB])$', prefix)
-    if not m:
-        return '', ''
-    return m['base'], m['part']
+            status, pano = stitch_one([pano, imgs[n]])
+            if pano is None:
+                return None, status, seconds, methods
+            methods.add('stitcher')
+            pos = None
+            if n + 1 < len(imgs) or (_args.fastpath and n not in _offsets):
+                pos = learn_offset(imgs, n, pano)
+            if pos and n + 1 < len(imgs):
+                # locate is only as precise as LEARN_SCALE.
+                pos = check_offset(pano, imgs[n], pos)
+        seconds.append(round(time.perf_counter() - t, 3))
+        trace(2, '{} part {}: {:.3f}s', outfile, n, seconds[-1])
+    return pano, cv.Stitcher_OK, seconds, methods
 
 
-def stitch_one(imgs):
-    stitcher = cv.Stitcher.create(_args.mode)
-    status, pano = stitcher.stitch(imgs)
-    if status != cv.Stitcher_OK:
-        trace(0, "Can't stitch images, error code = {}", status, color=Fore.RED)
+def read_scan(infile):
+    """
+    :return: a 2-tuple of the decoded image or None if it cannot be decoded
+             and a dict describing the file for the journal
+    """
+    with open(os.path.join(indir, infile), 'rb') as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    img = None
+    # Unlike cv.imread, cv.imdecode raises an error for an empty or
+    # truncated file rather than returning None.
+    if data:
+        try:
+            img = cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR)
+        except cv.error:
+            pass
+    return img, dict(name=infile, size=st.st_size, mtime=st.st_mtime,
+                     sha256=hashlib.sha256(data).hexdigest())
+
+
+def write_image(outpath, img):
+    """
+    Write the image to a temporary file and rename it so that an interrupted
+    run does not leave a partly written file that looks finished.
+
+    :return: True if the file was written
+    """
+    head, tail = os.path.split(outpath)
+    prefix, extension = os.path.splitext(tail)
+    # cv.imwrite chooses the format by the extension so keep it.
+    temppath = os.path.join(head, f'.{prefix}.{os.getpid()}.tmp{extension}')
+    try:
+        if not cv.imwrite(temppath, img):
+            return False
+        os.replace(temppath, outpath)
+    finally:
+        if os.path.exists(temppath):
+            os.remove(temppath)
+    return True
+
+
+def stitch_file(outfile, infiles):
+    """
+    Read, stitch and write one set of scans. This may be run in a worker
+    process. It never raises so that one bad set does not stop the others.
+
+    :return: a 4-tuple of outfile, one of WRITTEN, FAILED or SKIPPED, a
+             message to print in the main process and the journal record or
+             None if the set was skipped
+    """
+    if len(infiles) < 2:
+        return outfile, SKIPPED, f'Skipping – only one file found for: {outfile}', None
+    record = dict(outfile=outfile, status=FAILED, error=None, method=None,
+                  inputs=[], seconds={})
+    try:
+        return stitch_set(outfile, infiles, record)
+    except Exception as e:  # keep going with the other sets
+        record['error'] = f'{type(e).__name__}: {e}'
+        return outfile, FAILED, f'Failed to stitch {outfile}: {record["error"]}', record
+
+
+def stitch_set(outfile, infiles, record):
+    """
+    The body of stitch_file, which may raise.
+
+    :param record: the journal record, filled in as the set is processed
+    :return: see stitch_file
+    """
+    imgs = []
+    t = time.perf_counter()
+    for infile in infiles:
+        img, record_in = read_scan(infile)
+        record['inputs'].append(record_in)
+        if img is None:
+            record['error'] = 'unreadable'
+            return outfile, FAILED, f"can't read image {infile}", record
+        imgs.append(img)
+    record['seconds']['read'] = round(time.perf_counter() - t, 3)
+    t = time.perf_counter()
+    stitched_img, status, seconds, methods = stitch_parts(outfile, imgs)
+    record['seconds']['parts'] = seconds
+    if stitched_img is None:
+        record['error'] = status
+        return outfile, FAILED, f'Failed to stitch {outfile}, scans = {infiles}', record
+    record['seconds']['stitch'] = round(time.perf_counter() - t, 3)
+    how = record['method'] = ' and '.join(sorted(methods))
+    t = time.perf_counter()
+    outpath = os.path.join(outdir, outfile)
+    if not write_image(outpath, stitched_img):
+        record['error'] = 'unwritable'
+        return outfile, FAILED, f"can't write {outpath}", record
+    record['seconds']['write'] = round(time.perf_counter() - t, 3)
+    record['status'] = WRITTEN
+    return outfile, WRITTEN, f'written ({how}): {outpath}', record
+
+
+def load_journal():
+    """
+    The journal has one JSON record per line, appended as each set of scans
+    is stitched. A record is a dict containing:
+        outfile: the output file name
+        status: WRITTEN or FAILED
+        error: the stitcher's error code or a string if the set failed
+        method: "stitcher", "fast path" or "fast path and stitcher"
+        inputs: list of dicts of name, size, mtime and sha256 of the scans
+        seconds: dict of the time taken to read, stitch and write and of
+                 "parts", the list of the times to join each part after
+                 the first
+        finished: the local time the record was written
+
+    :return: a 2-tuple of a dict of outfile -> the latest record for it and
+             the number of records in the file
+    """
+    journal = {}
+    nrecords = 0
+    path = os.path.join(outdir, JOURNAL)
+    if not os.path.exists(path):
+        return journal, nrecords
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  # the last line of an interrupted run
+                continue
+            nrecords += 1
+            journal[record['outfile']] = record
+    return journal, nrecords
+
+
+def save_journal(journal):
+    """
+    Rewrite the journal with only the latest record for each output file.
+    """
+    path = os.path.join(outdir, JOURNAL)
+    temppath = path + '.tmp'
+    with open(temppath, 'w') as f:
+        for record in journal.values():
+            print(json.dumps(record), file=f)
+    os.replace(temppath, path)
+
+
+def scans_changed(record, infiles):
+    """
+    The scans' sizes and modification times are compared with the journal
+    record and the scans are hashed only if these differ.
+
+    :return: True if infiles are not the scans in the journal record
+    """
+    recorded = {r['name']: r for r in record['inputs']}
+    if sorted(recorded) != sorted(infiles):
+        return True
+    for infile in infiles:
+        inpath = os.path.join(indir, infile)
+        st = os.stat(inpath)
+        r = recorded[infile]
+        if st.st_size != r['size']:
+            return True
+        if st.st_mtime != r['mtime']:
+            with open(inpath, 'rb') as f:
+                if hashlib.file_digest(f, 'sha256').hexdigest() != r['sha256']:
+                    return True
+    return False
+
+
+def job_state(outfile, infiles, journal):
+    """
+    :return: None if the set of scans is to be stitched, otherwise the reason
+             it is not: WRITTEN or QUARANTINED
+    """
+    outpath = os.path.join(outdir, outfile)
+    record = journal.get(outfile)
+    if record is None:
+        # Written before there was a journal or by another program.
+        if not _args.overwrite and os.path.exists(outpath):
+            return WRITTEN
+        return None
+    if scans_changed(record, infiles):
         return None
-    return pano
+    if record['status'] == FAILED:
+        return None if _args.retry_failed else QUARANTINED
+    if not _args.overwrite and os.path.exists(outpath):
+        return WRITTEN
+    return None
+
+
+def init_worker(args):
+    """
+    Initialize a worker process. With the "spawn" start method (the default
+    on macOS) the globals set in __main__ are not inherited.
+    """
+    global _args, indir, outdir, flagchar
+    _args = args
+    indir, outdir, flagchar = args.indir, args.outdir, args.flagchar
+    if args.threads:
+        cv.setNumThreads(args.threads)
+
+
+def report(results, counts):
+    """
+    Print the results and add them to the journal as they arrive, so that
+    an interrupted run keeps the work done so far.
+
+    :param results: iterable of the 4-tuples returned by stitch_file, in the
+                    order of the scans whether or not a pool is used
+    :param counts: dict of the number of results with each status, updated
+    """
+    with open(os.path.join(outdir, JOURNAL), 'a') as journal_file:
+        for outfile, status, message, record in results:
+            counts[status] += 1
+            if status == WRITTEN:
+                trace(2, '{}', message)
+            else:
+                trace(1, '{}', message, color=Fore.MAGENTA)
+            if record:
+                record['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                print(json.dumps(record), file=journal_file, flush=True)
 
 
 def s(i: int):
@@ -112,57 +559,49 @@ def s(i: int):
 
 def main():
     t1 = time.perf_counter()
-    nwritten = 0
-    scans = defaultdict(list)
-    for filename in sorted(os.listdir(indir)):
-        inpath = os.path.join(indir, filename)
-        if not os.path.isfile(inpath):
-            trace(1, 'Skipping not file {}', filename, color=Fore.YELLOW)
-            continue
-        prefix, extension = os.path.splitext(filename)
-        if extension.lower() not in IMGEXTS:
-            trace(1, 'Skipping not image {}', filename, color=Fore.YELLOW)
-            continue
-        base, part = parse_filename(prefix)
-        if not base:
+    scans, others = index_stitch_sets(indir, IMGEXTS, _args.mdacode, flagchar)
+    for filename, reason in others:
+        if reason == FAILED_PARSE:
             trace(1, 'Failed parse: {}', filename, color=Fore.MAGENTA)
-            continue
-        trace(2, 'filename="{}", base="{}", part="{}", extension="{}"', filename, base, part, extension)
-        outfile = base + extension
-        outpath = os.path.join(_args.outdir, outfile)
-        trace(2, 'outpath={}', outpath)
-        if not _args.overwrite and os.path.exists(outpath):
+        else:
+            trace(1, 'Skipping {} {}', reason, filename, color=Fore.YELLOW)
+    journal, nrecords = load_journal()
+    counts = dict.fromkeys((WRITTEN, FAILED, SKIPPED, QUARANTINED), 0)
+    for outfile in list(scans):
+        state = job_state(outfile, scans[outfile], journal)
+        if state == WRITTEN:
             trace(2, 'Skipping already processed scan: {}', outfile)
-            continue
-        scans[outfile].append(filename)
+        elif state == QUARANTINED:
+            trace(2, 'Skipping failed scan: {}', outfile)
+            counts[QUARANTINED] += 1
+        if state:
+            del scans[outfile]
     trace(2, 'scans = {}', scans)
     if _args.dryrun:
         return
+    if nrecords > len(journal):
+        save_journal(journal)
 
-    for outfile in scans:
-        infiles = scans[outfile]
-        if len(infiles) != 2:
-            trace(1, 'Skipping – only one file found for: {}', outfile, color=Fore.MAGENTA)
-            continue
-        imgs = []
-        for infile in infiles:
-            inpath: str = os.path.join(indir, infile)
-            img = cv.imread(inpath)
-            if img is None:
-                trace(0, "can't read image {}", infile, color= Fore.RED)
-                sys.exit(-1)
-            imgs.append(img)
-        stitched_img = stitch_one(imgs)
-        if stitched_img is None:
-            trace(1, 'Failed to stitch {}, scans = {}', outfile, scans[outfile], color=Fore.MAGENTA)
-            continue
-        outpath = os.path.join(outdir, outfile)
-        cv.imwrite(outpath, stitched_img)
-        nwritten += 1
-        trace(2, 'written: {}', outpath)
+    if _args.jobs > 1 and len(scans) > 1:
+        with ProcessPoolExecutor(max_workers=_args.jobs,
+                                 initializer=init_worker,
+                                 initargs=(_args,)) as executor:
+            report(executor.map(stitch_file, scans, scans.values()), counts)
+    else:
+        init_worker(_args)
+        report((stitch_file(outfile, scans[outfile]) for outfile in scans),
+               counts)
     elapsed = time.perf_counter() - t1
+    nwritten = counts[WRITTEN]
 
     trace(1, f'Elapsed: {elapsed:6.3f} seconds. {nwritten} file{s(nwritten)} written.')
+    if counts[FAILED] or counts[SKIPPED]:
+        trace(1, '{} failed, {} skipped.', counts[FAILED], counts[SKIPPED])
+    if counts[QUARANTINED]:
+        trace(1, '{} previously failed not tried, see --retry-failed.',
+              counts[QUARANTINED], color=Fore.YELLOW)
+    return 1 if counts[FAILED] else 0
+
 
 if __name__ == '__main__':
     assert sys.version_info >= (3, 13)
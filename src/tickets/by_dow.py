@@ -2,33 +2,36 @@ import argparse
 import calendar
 import os
 import sys
-import pandas as pd
+
+import ticket_data
 
 OUTDIR = '/Users/mlg/pyprj/hrm/results/analytics/tickets'
 
 
-def main(incsvfile, outfile):
-    df = pd.read_csv(incsvfile,
-                     names='date quantity type totprice'.split(),
-                     usecols=(0,1,2,4),
-                     index_col=False)
-    df.date = pd.to_datetime(df.date, format='%d/%m/%Y')
-    if _args.start_date:
-        df = df[df.date >= _args.start_date]
-    if _args.end_date:
-        df = df[df.date <= _args.end_date]
+def report(df, outfile):
+    """
+    :param df: DataFrame with columns date, quantity, type and totprice
+    :param outfile: The XLSX file to write
+    """
     dow = list(calendar.day_abbr)
 
-    df['dayofweek'] = df.date.dt.dayofweek
+    df = df.assign(dayofweek=df.date.dt.dayofweek)
     # df['nameofday'] = df.dayofweek.apply(lambda x: dow[x])
 
-    dg = df.groupby('dayofweek',as_index=False)
-    ds=dg.sum()
-    ds['dayname']=ds.dayofweek.apply(lambda x: dow[x])
+    dg = df.groupby('dayofweek', as_index=False)
+    ds = dg[['quantity', 'totprice']].sum()
+    ds['dayname'] = ds.dayofweek.apply(lambda x: dow[x])
 
+    print(f"Writing to: {outfile}.")
     ds.to_excel(outfile)
 
 
+def main(incsvfile, outfile):
+    df = ticket_data.load(incsvfile, ('date', 'quantity', 'totprice'),
+                          _args.start_date, _args.end_date)
+    report(df, outfile)
+
+
 def getargs():
     parser = argparse.ArgumentParser(
         description='''
@@ -53,11 +56,12 @@ if __name__ == '__main__':
     if sys.version_info.major < 3 or sys.version_info.minor < 6:
         raise ImportError('requires Python 3.6')
     _args = getargs()
-    with open(_args.infile) as inf:
-        line = inf.readline()
-        if line.startswith(';'):
-            print('The input file is the raw CSV file. You must use the'
-                  ' cleaned file.')
-            sys.exit(-1)
+    if ticket_data.is_csv(_args.infile):
+        with open(_args.infile) as inf:
+            line = inf.readline()
+            if line.startswith(';'):
+                print('The input file is the raw CSV file. You must use the'
+                      ' cleaned file.')
+                sys.exit(-1)
     main(_args.infile,  _args.outfile)
     print('End by_dow.')
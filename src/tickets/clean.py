@@ -4,34 +4,68 @@
     1. Delete the first 4 lines of title, comments, etc.
     2. Convert the input latin-1 (iso-8859-1) to utf-8
     3. Delete lines starting with ' ' which are summary lines.
+    Optionally also write a typed Parquet or Feather cache of the cleaned
+    data. See ticket_data.py.
 """
+import argparse
 import codecs
 import sys
 
+import ticket_data
+
 FIRSTLINE = ';Detailed Ticket Report By Date'
 
 
-def main(infile, outfile):
+def clean_lines(infile):
+    """
+    :param infile: an iterator of the decoded lines of the Ticket Report file
+    :return: a generator of the data lines
+    :raises ValueError: if the first line is not FIRSTLINE
+    """
     line = next(infile)
     if line.strip() != FIRSTLINE:
-        print(f'The first line of the input CSV file is not "{FIRSTLINE}"')
-        sys.exit(-1)
+        raise ValueError(f'The first line of the input CSV file is not'
+                         f' "{FIRSTLINE}"')
     for i in range(3):
         next(infile)
     for line in infile:
         if line[0] != ' ':
-            outfile.write(line)
+            yield line
+
+
+def main(infile, outfile):
+    try:
+        outfile.writelines(clean_lines(infile))
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+
+
+def getargs():
+    parser = argparse.ArgumentParser(
+        description='''
+        Clean the Ticket Report file.
+        ''')
+    parser.add_argument('infile', help='''
+         The original Ticket Report file''')
+    parser.add_argument('outfile', help='''
+         The cleaned CSV file to write''')
+    parser.add_argument('-c', '--cache', help='''
+         Also write the cleaned data to this typed cache file, which must end
+         in .parquet or .feather. This needs the pyarrow package.''')
+    args = parser.parse_args()
+    if args.cache and not ticket_data.is_cache(args.cache):
+        parser.error(f'The cache file must end in one of'
+                     f' {ticket_data.CACHE_EXTS}.')
+    return args
 
 
 if __name__ == '__main__':
     assert sys.version_info >= (3, 6)
-    if len(sys.argv) > 2:
-        inf = sys.argv[1]
-        outf = sys.argv[2]
-        with codecs.open(inf, 'r', 'latin_1') as incsv,\
-                open(outf, 'w') as outcsv:
-            main(incsv, outcsv)
-    else:
-        print('Two parameters needed, the original ticket report and the'
-              ' output cleaned file.')
+    _args = getargs()
+    with codecs.open(_args.infile, 'r', 'latin_1') as incsv,\
+            open(_args.outfile, 'w') as outcsv:
+        main(incsv, outcsv)
+    if _args.cache:
+        ticket_data.save(ticket_data.read_csv(_args.outfile), _args.cache)
     print('End clean.')
@@ -6,9 +6,10 @@ Input is the file produced by clean.py.
 import argparse
 import datetime as dt
 import os.path
-import pandas as pd
 import sys
 
+import ticket_data
+
 OUTDIR = '/Users/mlg/pyprj/hrm/results/tickets'
 
 
@@ -19,7 +20,9 @@ def getargs():
         Input is the file produced by clean.py.
         ''')
     parser.add_argument('infile', help='''
-         The CSV file that has been cleaned by tickets.clean.py''')
+         The CSV file that has been cleaned by tickets.clean.py, a cache
+         made with its --cache option or the warehouse made by
+         tickets/warehouse.py''')
     parser.add_argument('-o', '--outdir', default=OUTDIR,
                         help='''Directory to contain the
         output report file. If omitted, the default is the directory
@@ -32,6 +35,7 @@ def getargs():
     last year. This is only used in January when reporting the December data.
     ''')
     args = parser.parse_args()
+    args.year = None
     if args.month:
         today = dt.date.today()
         args.year = today.year
@@ -40,30 +44,34 @@ def getargs():
     return args
 
 
-def main(args):
-    incsvfile = args.infile
+def report(df, outdir, year=None, month=None):
+    """
+    :param df: DataFrame with columns date, quantity, type and totprice,
+               already limited to the month if one is given
+    :param outdir: Directory to contain the output report file
+    :param year, month: If month is given, they are used to name the file
+    """
     basename = 'tickets_'
-    if _args.month:
-        basename += f'{args.year:04d}-{args.month:-02d}'
+    if month:
+        basename += f'{year:04d}-{month:-02d}'
     basename += '_daily.xlsx'
-    outreport = os.path.join(args.outdir, basename)
-    df = pd.read_csv(incsvfile,
-                     usecols=(0, 1, 2, 4),
-                     names='date quantity type totprice'.split(),
-                     index_col=False)
-    df.date = pd.to_datetime(df.date, format='%d/%m/%Y')
-    if args.month:
-        m = df.date.dt.month
-        y = df.date.dt.year
-        df = df[(m == args.month) & (y == args.year)]
-        assert len(df.date) > 0, f'No data in {args.year}-{args.month:02}.'
-    g = df.groupby(['date', 'type'])
+    outreport = os.path.join(outdir, basename)
+    g = df.groupby(['date', 'type'], observed=True)
     gg = g.sum().unstack().fillna('')
-    gg['datetot'] = df.groupby('date').sum()['totprice']
+    gg['datetot'] = df.groupby('date')['totprice'].sum()
     print(f"Writing to: {outreport}.")
     gg.to_excel(outreport)
 
 
+def main(args):
+    start = end = None
+    if args.month:
+        start, end = ticket_data.month_range(args.year, args.month)
+    df = ticket_data.load(args.infile, start=start, end=end)
+    if args.month:
+        assert len(df.date) > 0, f'No data in {args.year}-{args.month:02}.'
+    report(df, args.outdir, args.year, args.month)
+
 if __name__ == '__main__':
     assert sys.version_info >= (3, 8)
     _args = getargs()
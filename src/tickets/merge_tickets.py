@@ -7,14 +7,18 @@
     2. Convert the input latin-1 (iso-8859-1) input to utf-8
     3. Delete lines starting with ' ' which are summary lines.
 
-
+    Optionally also write a typed Parquet or Feather cache of the merged
+    data. See ticket_data.py.
 """
+import argparse
 import codecs
 import datetime
 import os.path
 import re
 import sys
 
+import ticket_data
+
 FILENAMEPAT = r'tickets_\d{4}-\d{2}(_\d{4}-\d{2})*.csv'
 SKIPLINES = 4
 
@@ -43,27 +47,44 @@ def main(infile, outfile):
     print(f'   {nlines} written.')
 
 
+def getargs():
+    parser = argparse.ArgumentParser(
+        description='''
+        Clean and merge the ticket report files.
+        ''')
+    parser.add_argument('indir', help='''
+         The directory containing the original ticket reports, named like
+         tickets_2019-03.csv''')
+    parser.add_argument('outfile', help='''
+         The merged, cleaned CSV file to write''')
+    parser.add_argument('-c', '--cache', help='''
+         Also write the merged data to this typed cache file, which must end
+         in .parquet or .feather. This needs the pyarrow package.''')
+    args = parser.parse_args()
+    if not os.path.isdir(args.indir):
+        parser.error('First parameter must be a directory containing the'
+                     ' original ticket reports.')
+    if args.cache and not ticket_data.is_cache(args.cache):
+        parser.error(f'The cache file must end in one of'
+                     f' {ticket_data.CACHE_EXTS}.')
+    return args
+
+
 if __name__ == '__main__':
     if sys.version_info.major < 3:
         raise ImportError('requires Python 3')
-    if len(sys.argv) <= 2:
-        print('Two parameters needed, the directory containing original ticket'
-              ' reports and the output cleaned file.')
-        sys.exit(1)
+    _args = getargs()
     alldates = set()
-    indir = sys.argv[1]
-    outf = sys.argv[2]
-    if not os.path.isdir(indir):
-        print('First parameter must be a directory containing the original'
-              ' ticket reports.')
-        sys.exit(2)
-    outcsv = open(outf, 'w')
-    for inf in sorted(os.listdir(indir)):
-        m = re.match(FILENAMEPAT, inf)
-        if not m:
-            print(f'Filename ignored: {inf}.')
-            continue
-        inpath = os.path.join(indir, inf)
-        with codecs.open(inpath, 'r', 'latin_1') as incsv:
-            main(incsv, outcsv)
+    indir = _args.indir
+    with open(_args.outfile, 'w') as outcsv:
+        for inf in sorted(os.listdir(indir)):
+            m = re.match(FILENAMEPAT, inf)
+            if not m:
+                print(f'Filename ignored: {inf}.')
+                continue
+            inpath = os.path.join(indir, inf)
+            with codecs.open(inpath, 'r', 'latin_1') as incsv:
+                main(incsv, outcsv)
+    if _args.cache:
+        ticket_data.save(ticket_data.read_csv(_args.outfile), _args.cache)
     print('End merge_tickets.')
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Produce the ticket reports from one reading of the Ticket Report file.
+
+The latin-1 file is decoded once and its lines are cleaned as by clean.py
+while they are read, so no cleaned file is written. The dates are parsed once
+and each report is made from the same DataFrame.
+"""
+import argparse
+import datetime as dt
+import io
+import os.path
+import sys
+
+import by_dow
+from clean import FIRSTLINE, clean_lines
+import daily
+import ticket_data
+import week_graph
+import weekly
+
+OUTDIR = '/Users/mlg/pyprj/hrm/results/tickets'
+REPORTS = ('daily', 'weekly', 'by_dow', 'week_graph')
+
+
+def read_tickets(infile, start=None, end=None):
+    """
+    :param infile: The original Ticket Report file, the file produced by
+                   clean.py, a cache written by ticket_data.save() or the
+                   warehouse made by warehouse.py
+    :param start, end: if given, the first and last dates to return
+    :return: DataFrame with columns date, quantity, type and totprice
+    """
+    if not ticket_data.is_csv(infile):
+        return ticket_data.load(infile, start=start, end=end)
+    with open(infile, encoding='latin_1') as f:
+        raw = f.readline().strip() == FIRSTLINE
+    if not raw:
+        return ticket_data.load(infile, start=start, end=end)
+    with open(infile, encoding='latin_1') as f:
+        df = ticket_data.read_csv(io.StringIO(''.join(clean_lines(f))))
+    return ticket_data.select_dates(df, start, end)
+
+
+def main(args):
+    start = end = None
+    if args.month:
+        start, end = ticket_data.month_range(args.year, args.month)
+    df = read_tickets(args.infile, start, end)
+    if args.month:
+        assert len(df.date) > 0, f'No data in {args.year}-{args.month:02}.'
+    if 'daily' in args.reports:
+        daily.report(df, args.outdir, args.year, args.month)
+    if 'weekly' in args.reports:
+        weekly.report(df, args.outdir, args.year, args.month)
+    if 'by_dow' in args.reports:
+        basename = 'tickets_'
+        if args.month:
+            basename += f'{args.year:04d}-{args.month:-02d}_'
+        basename += 'by_dow.xlsx'
+        by_dow.report(df, os.path.join(args.outdir, basename))
+    if 'week_graph' in args.reports:
+        week_graph.report(df, args.outdir, args.year, args.month)
+
+
+def getargs():
+    parser = argparse.ArgumentParser(
+        description='''
+        Produce the ticket reports from one reading of the Ticket Report file.
+        The daily and weekly reports are the ones merged by pretty2.py.
+        ''')
+    parser.add_argument('infile', help='''
+         The original Ticket Report file, the CSV file that has been cleaned
+         by tickets/clean.py, a cache made with its --cache option or the
+         warehouse made by tickets/warehouse.py''')
+    parser.add_argument('-o', '--outdir', default=OUTDIR,
+                        help='''Directory to contain the
+        output report files. If omitted, the default is the directory
+        "~/pyrpj/hrm/results/tickets".
+        ''')
+    parser.add_argument('-m', '--month', type=int,
+                        choices=list(range(1, 13)), help='''
+    If specified, limit reporting to the given month in the current year.
+    If the month specified is greater than the current month, the year is
+    last year unless --year is specified.
+    ''')
+    parser.add_argument('-r', '--reports', nargs='+', choices=REPORTS,
+                        default=['daily', 'weekly'], help='''
+    The reports to produce. The default is "daily weekly". Note that
+    pretty2.py merges all of the files in the output directory so only the
+    daily and weekly reports should be written to the directory it reads.
+    ''')
+    parser.add_argument('-y', '--year', type=int, help='''
+    The year of the month to report. Ignored unless --month is specified.
+    ''')
+    args = parser.parse_args()
+    if not args.month:
+        args.year = None
+    elif not args.year:
+        today = dt.date.today()
+        args.year = today.year
+        if args.month > today.month:
+            args.year -= 1
+    return args
+
+
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 8)
+    _args = getargs()
+    main(_args)
+    print('End report.')
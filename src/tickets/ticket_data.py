@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+    Read and write the cleaned ticket data.
+
+    The data is either the CSV file produced by clean.py or merge_tickets.py
+    or a typed cache of it in Parquet or Feather format made with their
+    --cache option. In the cache the date is a datetime, the type is
+    categorical, the quantity is an integer and the total price is held as
+    an integer number of pence so that it is exact. The cache files are
+    memory mapped when read and only the columns asked for are read.
+
+    The data may also be in the SQLite warehouse made by warehouse.py.
+
+    Whichever the format, load() returns a DataFrame with the columns date,
+    quantity, type and totprice in pounds. If a range of dates is given,
+    only the rows in the range are read where the format allows it:
+    1. A CSV file is in date order so the range is found by bisecting the
+       byte offsets of the file and only the lines in the range are parsed.
+    2. A Parquet file skips the row groups outside the range.
+    3. A Feather file is filtered before it is converted to a DataFrame.
+    4. The warehouse uses the index on the date.
+"""
+import calendar
+import datetime as dt
+import io
+import os.path
+import pandas as pd
+import sqlite3
+
+try:
+    from pyarrow import compute as pc, feather
+except ImportError:  # not installed. Only CSV files can be used.
+    pc = feather = None
+
+COLUMNS = ('date', 'quantity', 'type', 'totprice')
+CACHE_EXTS = ('.parquet', '.feather')
+WAREHOUSE_EXTS = ('.db', '.sqlite')
+# Small enough that a month's report reads few of the Parquet row groups.
+ROW_GROUP_SIZE = 16384
+
+
+def is_cache(path):
+    return os.path.splitext(path)[1].lower() in CACHE_EXTS
+
+
+def is_warehouse(path):
+    return os.path.splitext(path)[1].lower() in WAREHOUSE_EXTS
+
+
+def is_csv(path):
+    return not (is_cache(path) or is_warehouse(path))
+
+
+def month_range(year, month):
+    """
+    :return: the first and last dates of the month
+    """
+    return (dt.date(year, month, 1),
+            dt.date(year, month, calendar.monthrange(year, month)[1]))
+
+
+def read_csv(csvfile, columns=COLUMNS):
+    """
+    :param csvfile: path or file-like of the cleaned CSV data
+    :param columns: the columns to return
+    :return: DataFrame with the columns given
+    """
+    usecols = [COLUMNS.index(c) + (c == 'totprice') for c in columns]
+    df = pd.read_csv(csvfile,
+                     usecols=usecols,
+                     names='date quantity type x totprice'.split(),
+                     index_col=False)
+    if 'date' in columns:
+        df.date = pd.to_datetime(df.date, format='%d/%m/%Y')
+    return df
+
+
+def _line_date(f, offset):
+    """
+    :return: the offset of the first line starting at or after offset and the
+             date of that line as (year, month, day), or None at the end of
+             the file
+    """
+    if offset:
+        f.seek(offset - 1)
+        f.readline()
+    else:
+        f.seek(0)
+    pos = f.tell()
+    line = f.readline()
+    if not line.strip():
+        return pos, None
+    d, m, y = line[:10].split(b'/')
+    return pos, (int(y), int(m), int(d))
+
+
+def _bisect_csv(f, size, date):
+    """
+    :return: the offset of the first line whose date is not before date
+    """
+    target = (date.year, date.month, date.day)
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        linedate = _line_date(f, mid)[1]
+        if linedate is None or linedate >= target:
+            hi = mid
+        else:
+            lo = mid + 1
+    return _line_date(f, lo)[0]
+
+
+def read_csv_range(path, columns=COLUMNS, start=None, end=None):
+    """
+    Read only the lines of the cleaned CSV file from start to end. The file
+    must be in date order, as written by clean.py and merge_tickets.py.
+
+    :param start, end: the first and last dates to read or None
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        first = _bisect_csv(f, size, start) if start else 0
+        stop = (_bisect_csv(f, size, end + dt.timedelta(days=1)) if end
+                else size)
+        f.seek(first)
+        data = f.read(max(stop - first, 0))
+    return read_csv(io.BytesIO(data), columns)
+
+
+def save(df, path):
+    """
+    Write the DataFrame returned by read_csv as a typed cache.
+
+    :param path: the cache file, ending in .parquet or .feather
+    """
+    if feather is None:
+        raise ImportError('pyarrow is needed to write a ticket cache.')
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in CACHE_EXTS:
+        raise ValueError(f'The cache file must end in one of {CACHE_EXTS}.')
+    df = pd.DataFrame({
+        'date': df.date,
+        'quantity': df.quantity.astype('int32'),
+        'type': df.type.astype('category'),
+        'totpence': (df.totprice * 100).round().astype('int64'),
+    }).reset_index(drop=True)
+    print(f"Writing to: {path}.")
+    if extension == '.parquet':
+        df.to_parquet(path, index=False, row_group_size=ROW_GROUP_SIZE)
+    else:
+        # Uncompressed so that reading it is a memory map, not a copy.
+        feather.write_feather(df, path, compression='uncompressed')
+
+
+def read_cache(path, columns=COLUMNS, start=None, end=None):
+    """
+    :param path: a cache written by save()
+    :param columns: the columns to return
+    :param start, end: the first and last dates to read or None
+    :return: DataFrame with the columns given
+    """
+    if feather is None:
+        raise ImportError(f'pyarrow is needed to read {path}.')
+    cachecols = ['totpence' if c == 'totprice' else c for c in columns]
+    if path.lower().endswith('.parquet'):
+        filters = []
+        if start:
+            filters.append(('date', '>=', pd.Timestamp(start)))
+        if end:
+            filters.append(('date', '<=', pd.Timestamp(end)))
+        df = pd.read_parquet(path, columns=cachecols, memory_map=True,
+                             filters=filters or None)
+    else:
+        readcols = cachecols
+        if (start or end) and 'date' not in cachecols:
+            readcols = ['date'] + cachecols  # to filter on
+        table = feather.read_table(path, columns=readcols, memory_map=True)
+        if start:
+            table = table.filter(pc.field('date') >= pd.Timestamp(start))
+        if end:
+            table = table.filter(pc.field('date') <= pd.Timestamp(end))
+        df = table.select(cachecols).to_pandas()
+    return to_pounds(df)
+
+
+def read_warehouse(path, columns=COLUMNS, start=None, end=None):
+    """
+    :param path: the SQLite database made by warehouse.py
+    :param columns: the columns to return
+    :param start, end: the first and last dates to read or None
+    :return: DataFrame with the columns given
+    """
+    dbcols = ['totpence' if c == 'totprice' else c for c in columns]
+    query = f'SELECT {", ".join(dbcols)} FROM tickets'
+    where = []
+    params = []
+    if start:
+        where.append('date >= ?')
+        params.append(start.isoformat())
+    if end:
+        where.append('date <= ?')
+        params.append(end.isoformat())
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY rowid'
+    # Open read-only so that a mistyped path is not created.
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+    if 'date' in dbcols:
+        df.date = pd.to_datetime(df.date, format='%Y-%m-%d')
+    if 'type' in dbcols:
+        df.type = df.type.astype('category')
+    return to_pounds(df)
+
+
+def to_pounds(df):
+    """
+    :return: the DataFrame with its totpence column, if any, replaced by
+             totprice in pounds
+    """
+    if 'totpence' not in df:
+        return df
+    df['totpence'] = df.totpence / 100
+    return df.rename(columns={'totpence': 'totprice'})
+
+
+def select_dates(df, start=None, end=None):
+    """
+    :param start, end: the first and last dates as datetime.date or None
+    :return: the rows of the DataFrame from start to end
+    """
+    if start:
+        df = df[df.date >= pd.Timestamp(start)]
+    if end:
+        df = df[df.date <= pd.Timestamp(end)]
+    return df
+
+
+def load(path, columns=COLUMNS, start=None, end=None):
+    """
+    :param path: the cleaned CSV file, a cache written by save() or the
+                 warehouse made by warehouse.py
+    :param columns: the columns to return. Only these are read from a cache
+                    or the warehouse.
+    :param start, end: if given, the first and last dates as datetime.date
+                       or strings like 2024-03-01. Only the rows in this
+                       range are read.
+    :return: DataFrame with the columns given
+    """
+    if isinstance(start, str):
+        start = dt.date.fromisoformat(start)
+    if isinstance(end, str):
+        end = dt.date.fromisoformat(end)
+    if is_warehouse(path):
+        return read_warehouse(path, columns, start, end)
+    if is_cache(path):
+        return read_cache(path, columns, start, end)
+    if not (start or end):
+        return read_csv(path, columns)
+    readcols = columns if 'date' in columns else ('date',) + tuple(columns)
+    df = read_csv_range(path, readcols, start, end)
+    # In case the file is not quite in date order.
+    return select_dates(df, start, end)[list(columns)]
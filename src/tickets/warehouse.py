@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+    Ingest ticket report files into an SQLite warehouse.
+
+    Unlike merge_tickets.py, which rebuilds the merged file from all of the
+    monthly files every time, each file is ingested once:
+    1. A file already ingested is recognised by the SHA-256 hash of its
+       content and skipped.
+    2. The file is cleaned as by clean.py.
+    3. All of its rows are added in one transaction. The days table has the
+       date as its primary key so a file containing a date already ingested
+       from another file is rejected as a whole.
+
+    The tickets table's date column, like 2024-03-01, is indexed so that the
+    reports read only the dates they need. A month is a range of dates so it
+    needs no column of its own. See ticket_data.load().
+"""
+import argparse
+import csv
+import datetime as dt
+import hashlib
+import os.path
+import re
+import sqlite3
+import sys
+
+from clean import clean_lines
+from merge_tickets import FILENAMEPAT
+import ticket_data
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    sha256 TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    ingested TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL REFERENCES files
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    date TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    totpence INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_date ON tickets (date);
+'''
+
+
+def connect(dbpath):
+    conn = sqlite3.connect(dbpath)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_rows(lines):
+    """
+    :param lines: the cleaned lines of a ticket report file
+    :return: list of (date, quantity, type, totpence) where date is like
+             2024-03-01
+    """
+    dates = {}  # dd/mm/yyyy -> yyyy-mm-dd
+    rows = []
+    for fields in csv.reader(lines):
+        if not fields:
+            continue
+        date = dates.get(fields[0])
+        if date is None:
+            date = dt.datetime.strptime(fields[0], '%d/%m/%Y').date()
+            date = dates[fields[0]] = date.isoformat()
+        rows.append((date, int(fields[1]), fields[2],
+                     round(float(fields[4]) * 100)))
+    return rows
+
+
+def ingest(conn, path):
+    """
+    :return: the number of rows added or None if the file was not ingested
+    """
+    name = os.path.basename(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    row = conn.execute('SELECT name, ingested FROM files WHERE sha256 = ?',
+                       (sha256,)).fetchone()
+    if row:
+        print(f'{name} was ingested as {row[0]} at {row[1]}. Skipped.')
+        return None
+    try:
+        rows = parse_rows(clean_lines(
+            iter(data.decode('latin_1').splitlines(keepends=True))))
+    except ValueError as e:
+        print(f'{name}: {e}. Skipped.')
+        return None
+    days = sorted({r[0] for r in rows})
+    now = dt.datetime.now().isoformat(' ', 'seconds')
+    try:
+        with conn:
+            conn.execute('INSERT INTO files VALUES (?, ?, ?)',
+                         (sha256, name, now))
+            conn.executemany('INSERT INTO days VALUES (?, ?)',
+                             ((d, sha256) for d in days))
+            conn.executemany('INSERT INTO tickets VALUES (?, ?, ?, ?)',
+                             rows)
+    except sqlite3.IntegrityError:
+        date, other = conn.execute(
+            'SELECT days.date, files.name FROM days JOIN files USING (sha256)'
+            f' WHERE days.date IN ({",".join("?" * len(days))})'
+            ' ORDER BY days.date', days).fetchone()
+        print(f'Duplicate date {date} in {name}, already ingested from'
+              f' {other}. Skipped.')
+        return None
+    print(f'{name}: {len(rows)} rows ingested.')
+    return len(rows)
+
+
+def main():
+    conn = connect(_args.dbfile)
+    nfiles = nrows = 0
+    for inpath in _args.infiles:
+        if os.path.isdir(inpath):
+            paths = [os.path.join(inpath, f)
+                     for f in sorted(os.listdir(inpath))
+                     if re.match(FILENAMEPAT, f)]
+        else:
+            paths = [inpath]
+        for path in paths:
+            n = ingest(conn, path)
+            if n is not None:
+                nfiles += 1
+                nrows += n
+    conn.close()
+    print(f'{nfiles} files, {nrows} rows ingested into {_args.dbfile}.')
+
+
+def getargs():
+    parser = argparse.ArgumentParser(
+        description='''
+        Ingest ticket report files into an SQLite warehouse. Files already
+        ingested are skipped. A file containing a date already ingested is
+        rejected.
+        ''')
+    parser.add_argument('dbfile', help='''
+         The SQLite database file, ending in .db or .sqlite. It is created if
+         it does not exist.''')
+    parser.add_argument('infiles', nargs='+', help='''
+         The original Ticket Report files or directories containing them.
+         In a directory only the files named like tickets_2019-03.csv are
+         ingested.''')
+    args = parser.parse_args()
+    if not ticket_data.is_warehouse(args.dbfile):
+        parser.error(f'The database file must end in one of'
+                     f' {ticket_data.WAREHOUSE_EXTS}.')
+    return args
+
+
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 8)
+    _args = getargs()
+    main()
+    print('End warehouse.')
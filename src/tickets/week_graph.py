@@ -8,10 +8,10 @@ import argparse
 from openpyxl import Workbook, load_workbook
 import datetime as dt
 import os.path
-import pandas as pd
 import sys
 
 from config import ADMISSION_TYPES
+import ticket_data
 
 
 OUTDIR = '/Users/mlg/pyprj/hrm/results/analytics/tickets'
@@ -37,37 +37,38 @@ for yl in SKIPLIST:
     SKIPWEEKS += [f'{yl[0]}-{m[0]:02d}-{m[1]:02d}' for m in yl[1:]]
 
 
-def one_report(df, suffix):
+def one_report(df, suffix, outdir, year, month):
     basename = 'tickets_'
-    if _args.month:
-        basename += f'{_args.year:04d}-{_args.month:-02d}_'
-    basename += 'weekly_' + suffix + '.xlsx'
-    outreport = os.path.join(_args.outdir, basename)
+    if month:
+        basename += f'{year:04d}-{month:-02d}_'
+    basename += 'week_graph_' + suffix + '.xlsx'
+    outreport = os.path.join(outdir, basename)
     g = df.groupby(['date', 'dayofweek'])
-    gg = g.sum().unstack().fillna('')
-    gg['weektot'] = df.groupby('date').sum()['totprice']
+    gg = g[['quantity', 'totprice']].sum().unstack().fillna('')
+    gg['weektot'] = df.groupby('date')['totprice'].sum()
     print(f"Writing to: {outreport}.")
     gg.to_excel(outreport)
 
 
-def main():
-    incsvfile = _args.infile
-    df = pd.read_csv(incsvfile,
-                     names='date quantity type totprice'.split(),
-                     usecols=(0, 1, 2, 4),
-                     index_col=False)
-    dfdate = pd.to_datetime(df.date, format='%d/%m/%Y')
-    if _args.month:
-        m = dfdate.dt.month
-        y = dfdate.dt.year
-        df = df[(m == _args.month) & (y == _args.year)]
-    #
-    df['dayofweek'] = dfdate.dt.dayofweek
-    one_report(df, 'full')
+def report(df, outdir, year=None, month=None):
+    """
+    :param df: DataFrame with columns date, quantity, type and totprice,
+               already limited to the month if one is given
+    :param outdir: Directory to contain the output report files
+    :param year, month: If month is given, they are used to name the files
+    """
+    df = df.assign(dayofweek=df.date.dt.dayofweek)
+    one_report(df, 'full', outdir, year, month)
     df2 = df[df.type.isin(ADMISSION_TYPES)]
-    one_report(df2, 'admission')
+    one_report(df2, 'admission', outdir, year, month)
     df3 = df[~df.type.isin(ADMISSION_TYPES)]
-    one_report(df3, 'other')
+    one_report(df3, 'other', outdir, year, month)
+
+
+def main():
+    incsvfile = _args.infile
+    df = ticket_data.load(incsvfile)
+    report(df, _args.outdir)
 
 
 def getargs():
@@ -11,6 +11,7 @@ import pandas as pd
 import sys
 
 from config import ADMISSION_TYPES
+import ticket_data
 
 
 OUTDIR = '/Users/mlg/pyprj/hrm/results/analytics/tickets'
@@ -18,37 +19,43 @@ OUTDIR = '/Users/mlg/pyprj/hrm/results/analytics/tickets'
 # df[df['A'].isin([3, 6])]
 
 
-def one_report(df, suffix):
+def one_report(df, suffix, outdir, year, month):
     basename = 'tickets_'
-    if _args.month:
-        basename += f'{_args.year:04d}-{_args.month:-02d}_'
+    if month:
+        basename += f'{year:04d}-{month:-02d}_'
     basename += 'weekly_' + suffix + '.xlsx'
-    outreport = os.path.join(_args.outdir, basename)
-    g = df.groupby(['date', 'type'])
+    outreport = os.path.join(outdir, basename)
+    g = df.groupby(['date', 'type'], observed=True)
     gg = g.sum().unstack().fillna('')
-    gg['weektot'] = df.groupby('date').sum()['totprice']
+    gg['weektot'] = df.groupby('date')['totprice'].sum()
     print(f"Writing to: {outreport}.")
     gg.to_excel(outreport)
 
 
-def main():
-    incsvfile = _args.infile
-    df = pd.read_csv(incsvfile,
-                     names='date quantity type totprice'.split(),
-                     usecols=(0,1,2,4),
-                     index_col=False)
-    dfdate = pd.to_datetime(df.date, format='%d/%m/%Y')
-    if _args.month:
-        m = dfdate.dt.month
-        y = dfdate.dt.year
-        df = df[(m == _args.month) & (y == _args.year)]
+def report(df, outdir, year=None, month=None):
+    """
+    :param df: DataFrame with columns date, quantity, type and totprice,
+               already limited to the month if one is given
+    :param outdir: Directory to contain the output report files
+    :param year, month: If month is given, they are used to name the files
+    """
     # Coerce the date to be the first day of the week (Monday).
-    df['date'] = dfdate - pd.to_timedelta(dfdate.dt.dayofweek, unit='D')
-    one_report(df, 'full')
+    df = df.assign(date=df.date - pd.to_timedelta(df.date.dt.dayofweek,
+                                                  unit='D'))
+    one_report(df, 'full', outdir, year, month)
     df2 = df[df.type.isin(ADMISSION_TYPES)]
-    one_report(df2, 'admission')
+    one_report(df2, 'admission', outdir, year, month)
     df3 = df[~df.type.isin(ADMISSION_TYPES)]
-    one_report(df3, 'other')
+    one_report(df3, 'other', outdir, year, month)
+
+
+def main():
+    incsvfile = _args.infile
+    start = end = None
+    if _args.month:
+        start, end = ticket_data.month_range(_args.year, _args.month)
+    df = ticket_data.load(incsvfile, start=start, end=end)
+    report(df, _args.outdir, _args.year, _args.month)
 
 
 def getargs():
@@ -62,7 +69,9 @@ def getargs():
         "other" report contains non-admission sales.
         ''')
     parser.add_argument('infile', help='''
-         The CSV file that has been cleaned by tickets.clean.py''')
+         The CSV file that has been cleaned by tickets.clean.py, a cache
+         made with its --cache option or the warehouse made by
+         tickets/warehouse.py''')
     parser.add_argument('-m', '--month', type=int,
                         choices=list(range(1, 13)), help='''
     If specified, limit reporting to the given month in the current year.''')
@@ -71,6 +80,7 @@ def getargs():
         "results" in the same directory that the input file resides.
         ''')
     args = parser.parse_args()
+    args.year = None
     if not args.outdir:
         args.outdir = OUTDIR
     if args.month:
@@ -6,12 +6,26 @@ See get_args for details.
 
 """
 import argparse
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from colorama import Fore, Style
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import cProfile
+import hashlib
+import io
+import json
 import math
 import os.path
-from PIL import Image
+import signal
+from PIL import features, Image
 import sys
+import threading
+import time
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # not Linux or not installed. --watch will poll.
+    INotify = inotify_flags = None
 
 
 GREY = 'F2F4F6'
@@ -19,8 +33,45 @@ WHITE = 'FFFFFF'
 GOLD = 'AA915A'
 IMAGE_MODE_RGBA = 'RGBA'
 IMAGE_MODE_RGB = 'RGB'
+# The intermediate image that the thumbnails are resized from is kept at least
+# this many times larger than the largest thumbnail so that the final resize
+# still has enough pixels to resample from. See Image.resize(reducing_gap=).
+REDUCING_GAP = 2.0
+# The manifest in the output directory records what each thumbnail was built
+# from so that unchanged input files are skipped. See load_manifest.
+MANIFEST = '.thumb_manifest.json'
+# Canvases for padded thumbnails, reused from file to file. See get_canvas.
+_canvases = threading.local()
+# The seconds spent in each stage of processing the current file. See timed.
+STAGES = ('decode', 'resize', 'pad', 'save')
+_stage_times = defaultdict(float)
+# Upper bounds in seconds of the bins of the histogram of time per file.
+HISTOGRAM_BINS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, math.inf)
+
+# profile is the name of an entry in ENCODER_PROFILES or None to use the
+# profile for the input file's type.
+Img = namedtuple('Img', ['w', 'h', 'name', 'background', 'profile'],
+                 defaults=[None])
 
-Img = namedtuple('Img', ['w', 'h', 'name', 'background'])
+# Keyword arguments to Image.save. "extension" is removed before the call. It
+# is used for the thumbnail file name unless the input file's extension is
+# for the same format.
+ENCODER_PROFILES = {
+    'jpeg': dict(format='JPEG', extension='.jpg', quality=75,
+                 optimize=True, progressive=True, subsampling='4:2:0'),
+    'jpeg-hq': dict(format='JPEG', extension='.jpg', quality=90,
+                    optimize=True, progressive=True, subsampling='4:4:4'),
+    # Level 9 is a few percent smaller than Pillow's default of 6 and, at
+    # thumbnail sizes, takes about half as long again to save.
+    'png': dict(format='PNG', extension='.png', compress_level=9),
+    'webp': dict(format='WEBP', extension='.webp', quality=80, method=6),
+    'avif': dict(format='AVIF', extension='.avif', quality=60, speed=6),
+}
+# The profile used for an input file's type if neither the Img nor the
+# --profile option give one. Other types are saved with the Pillow defaults.
+EXTENSION_PROFILES = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png'}
+# Formats that are only available if Pillow was built with them.
+OPTIONAL_FORMATS = ('WEBP', 'AVIF')
 
 # The following image sizes are from documentation supplied by LiberatingIT.
 # The keys ending in '-x' are meant to be used with just the preamble. So,
@@ -41,9 +92,25 @@ THUMB_IMG_SIZES = {
 }
 
 
-def trace(level, template, *args):
+def trace(level, template, *args, color=None):
     if _args.verbose >= level:
-        print(template.format(*args))
+        if color:
+            print(f'{color}{template.format(*args)}{Style.RESET_ALL}')
+        else:
+            print(template.format(*args))
+
+
+@contextmanager
+def timed(stage):
+    """
+    Add the time spent in the with statement to the stage's total for the
+    current file. onefile resets the totals and onefile_job returns them.
+    """
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_times[stage] += time.perf_counter() - t
 
 
 def make_background_tuple(hexstr: str):  # hexstr can be like F1F2F3 or 0xF1F2F3
@@ -54,7 +121,52 @@ def make_background_tuple(hexstr: str):  # hexstr can be like F1F2F3 or 0xF1F2F3
     return red, green, blue
 
 
-def pad_height(inimage, target_width, target_height, background):
+def get_canvas(mode, size, background, box):
+    """
+    Return a canvas to paste a resized image into. One canvas is kept per
+    (mode, size, background) in each thread and reused for every input file
+    so that a batch does not allocate a new full size image per thumbnail.
+    Only the parts of the canvas outside of box, where the previous image may
+    have been pasted, are filled with the background.
+
+    The returned image is overwritten by the next call with the same mode,
+    size and background, so it must be saved before then.
+
+    :param box: (left, upper, right, lower) of where the image will be pasted
+    """
+    cache = _canvases.__dict__
+    canvas = cache.get((mode, size, background))
+    if canvas is None:
+        # noinspection PyTypeChecker
+        canvas = cache[(mode, size, background)] = Image.new(mode, size,
+                                                             background)
+        return canvas
+    width, height = size
+    left, upper, right, lower = box
+    for band in ((0, 0, width, upper), (0, lower, width, height),
+                 (0, upper, left, lower), (right, upper, width, lower)):
+        if band[0] < band[2] and band[1] < band[3]:
+            canvas.paste(background, band)
+    return canvas
+
+
+def paste_resized(target_image, resized_image, origin, background):
+    """
+    Paste the resized image into the canvas. If the canvas has no alpha
+    channel, as when saving a PNG as a JPEG, transparent areas of the image
+    are flattened onto the background.
+    """
+    if ('A' in resized_image.getbands() and
+            'A' not in target_image.getbands()):
+        x, y = origin
+        target_image.paste(background, (x, y, x + resized_image.width,
+                                        y + resized_image.height))
+        target_image.paste(resized_image, origin, resized_image)
+    else:
+        target_image.paste(resized_image, origin)
+
+
+def pad_height(inimage, target_width, target_height, background, mode):
     """
     The input image is too wide. Resize it so that the width is target_width
     and then pad the top and bottom so that the height is target_height.
@@ -63,7 +175,8 @@ def pad_height(inimage, target_width, target_height, background):
     :param target_width:
     :param target_height:
     :param background: 3-tuple of red, blue, green
-    :return the resized and padded image
+    :param mode: the mode of the returned image, see get_image_mode
+    :return the resized and padded image, see get_canvas
     """
     trace(2, 'Begin pad_height. Target width, height = ({}, {})', target_width,
           target_height)
@@ -71,16 +184,18 @@ def pad_height(inimage, target_width, target_height, background):
     wh_ratio = float(width) / float(height)
     unpadded_height = int(round(target_width / wh_ratio))
     trace(2, 'Resizing image to ({}, {})', target_width, unpadded_height)
-    resized_image = inimage.resize((target_width, unpadded_height))
+    with timed('resize'):
+        resized_image = inimage.resize((target_width, unpadded_height))
     y_origin = int(math.ceil((target_height - unpadded_height) / 2.))
-    # noinspection PyTypeChecker
-    target_image = Image.new(image_mode, (target_width, target_height),
-                             background)
-    target_image.paste(resized_image, (0, y_origin))
+    with timed('pad'):
+        target_image = get_canvas(mode, (target_width, target_height),
+                                  background, (0, y_origin, target_width,
+                                               y_origin + unpadded_height))
+        paste_resized(target_image, resized_image, (0, y_origin), background)
     return target_image
 
 
-def pad_width(inimage, target_width, target_height, background):
+def pad_width(inimage, target_width, target_height, background, mode):
     """
     The input image is too tall. Resize it so that the height is target_height
     and then pad the left and right so that the width is target_width.
@@ -89,7 +204,8 @@ def pad_width(inimage, target_width, target_height, background):
     :param target_width:
     :param target_height:
     :param background: 3-tuple of red, blue, green
-    :return the resized and padded image
+    :param mode: the mode of the returned image, see get_image_mode
+    :return the resized and padded image, see get_canvas
     """
     trace(2, 'Begin pad_width. Target width, height = ({}, {})', target_width,
           target_height)
@@ -97,56 +213,473 @@ def pad_width(inimage, target_width, target_height, background):
     wh_ratio = float(width) / float(height)
     unpadded_width = int(round(target_height * wh_ratio))
     trace(2, "Resizing image to ({}, {})", unpadded_width, target_height)
-    resized_image = inimage.resize((unpadded_width, target_height))
+    with timed('resize'):
+        resized_image = inimage.resize((unpadded_width, target_height))
     x_origin = int(math.ceil((target_width - unpadded_width) / 2.))
-    # noinspection PyTypeChecker
-    target_image = Image.new(image_mode, (target_width, target_height),
-                             background)
-    target_image.paste(resized_image, (x_origin, 0))
+    with timed('pad'):
+        target_image = get_canvas(mode, (target_width, target_height),
+                                  background, (x_origin, 0,
+                                               x_origin + unpadded_width,
+                                               target_height))
+        paste_resized(target_image, resized_image, (x_origin, 0), background)
     return target_image
 
 
+def make_thumb(inimage, wh_ratio, target_width, target_height, background,
+               mode):
+    """
+    Resize and pad the image to the target size.
+
+    :param wh_ratio: the width/height ratio of the original image
+    :return the resized and padded image
+    """
+    thumb_wh_ratio = float(target_width) / float(target_height)
+    if wh_ratio > thumb_wh_ratio:
+        return pad_height(inimage, target_width, target_height, background,
+                          mode)
+    return pad_width(inimage, target_width, target_height, background, mode)
+
+
+def has_alpha(image):
+    """
+    :return: True if the image has an alpha channel or a transparent colour
+    """
+    return 'A' in image.getbands() or 'transparency' in image.info
+
+
+def get_image_mode(extension, profile=None, alpha=True):
+    """
+    The padding is always an opaque background colour so an RGBA thumbnail
+    is only needed if the input image itself has transparency.
+
+    :param extension: the file extension including the leading "."
+    :param profile: the encoder profile name, see get_profile
+    :param alpha: False if the input image has no transparency, see has_alpha
+    :return: the mode of the thumbnail images for a file of this type
+    """
+    if (not alpha or extension.lower() in ('.jpg', '.jpeg') or
+            profile and ENCODER_PROFILES[profile]['format'] == 'JPEG'):
+        return IMAGE_MODE_RGB
+    return IMAGE_MODE_RGBA
+
+
+def get_profile(img, extension):
+    """
+    :return: the name of the encoder profile for the thumbnail or None to
+             save it with the Pillow defaults in the input file's format.
+    """
+    profile = (_args.profile or img.profile or
+               EXTENSION_PROFILES.get(extension.lower()))
+    if not profile:
+        return None
+    image_format = ENCODER_PROFILES[profile]['format']
+    if image_format in OPTIONAL_FORMATS and not features.check(
+            image_format.lower()):
+        trace(1, '{} is not supported by this Pillow, using JPEG.',
+              image_format)
+        return 'jpeg'
+    return profile
+
+
+def get_extension(profile, extension):
+    """
+    :return: the extension for the thumbnail file name
+    """
+    if profile is None:
+        return extension
+    if (Image.registered_extensions().get(extension.lower()) ==
+            ENCODER_PROFILES[profile]['format']):
+        return extension  # keep ".jpeg" or ".JPG"
+    return ENCODER_PROFILES[profile]['extension']
+
+
+def save_thumb(thumb_image, fp, profile, image_format=None):
+    """
+    Save the thumbnail with the settings of the encoder profile.
+
+    :param fp: a file name or a file object
+    :param profile: the encoder profile name, see get_profile
+    :param image_format: the format to use if profile is None. If this is
+                         also None, the format is taken from the file name.
+    """
+    if profile is None:
+        thumb_image.save(fp, format=image_format)
+        return
+    params = dict(ENCODER_PROFILES[profile])
+    del params['extension']
+    if _args.quality and 'quality' in params:
+        params['quality'] = _args.quality
+    thumb_image.save(fp, **params)
+
+
+def default_size(thumb_image, extension):
+    """
+    :return: the number of bytes of the thumbnail saved without an encoder
+             profile as it was before profiles were introduced, for
+             --report.
+    """
+    buf = io.BytesIO()
+    # noinspection PyTypeChecker
+    thumb_image.convert(get_image_mode(extension)).save(
+        buf, format=Image.registered_extensions()[extension.lower()])
+    return buf.tell()
+
+
+def decoded_size(input_image, scale=1):
+    """
+    :return: the approximate number of bytes that Pillow needs to hold the
+             image decoded at 1/scale of its size. Pillow stores most
+             multi-band modes with four bytes per pixel.
+    """
+    bytes_per_pixel = 1 if input_image.mode in ('1', 'L', 'P') else 4
+    return ((input_image.width // scale) * (input_image.height // scale) *
+            bytes_per_pixel)
+
+
+def limit_memory(input_image, wanted):
+    """
+    Make sure that decoding the image will not need more than --memlimit
+    megabytes. A JPEG can be decoded at 1/2, 1/4 or 1/8 of its size so, if
+    needed, the size wanted is reduced until it fits, even if the thumbnails
+    lose quality. Pillow always decodes other formats such as PNG and TIFF at
+    full size so they are refused if they do not fit.
+
+    :param wanted: the size that would be passed to Image.draft
+    :return: the size to pass to Image.draft
+    """
+    limit = _args.memlimit * 1024 * 1024
+    width, height = input_image.size
+    scales = (1, 2, 4, 8) if input_image.format == 'JPEG' else (1,)
+    # The scale that the JPEG decoder would choose for the size wanted.
+    drafted = max([s for s in scales
+                   if s <= min(width // wanted[0], height // wanted[1])],
+                  default=1)
+    for scale in scales:
+        if scale < drafted or decoded_size(input_image, scale) > limit:
+            continue
+        if scale > drafted:
+            trace(1, '{}x{} image decoded at 1/{} size to stay within {} MB',
+                  width, height, scale, _args.memlimit, color=Fore.YELLOW)
+            wanted = (width // scale, height // scale)
+        return wanted
+    raise MemoryError(f'A {width}x{height} {input_image.format} image needs '
+                      f'{decoded_size(input_image) // (1024 * 1024)} MB to '
+                      f'decode, more than --memlimit {_args.memlimit} MB')
+
+
+def make_intermediate(input_image, img_sizes):
+    """
+    Reduce the input image as far as possible while keeping it at least
+    REDUCING_GAP times the size of the largest thumbnail wanted. For a JPEG
+    most of the reduction is done by the decoder (see Image.draft) so the full
+    resolution image is never decoded. The rest is done by Image.reduce which
+    is much cheaper than resizing from the full resolution image for every
+    thumbnail.
+
+    If --memlimit is set, the decoded image is kept within the limit, see
+    limit_memory.
+
+    :param input_image: an image that has been opened but not yet loaded
+    :param img_sizes: dict of Img or of tuples (width, height, name, bg)
+    :return: the intermediate image
+    """
+    width, height = input_image.size
+    scale = max(min(w / width, h / height) for w, h, *_ in img_sizes.values())
+    wanted = (math.ceil(width * scale * REDUCING_GAP),
+              math.ceil(height * scale * REDUCING_GAP))
+    if _args.memlimit:
+        wanted = limit_memory(input_image, wanted)
+    if wanted[0] >= width or wanted[1] >= height:
+        return input_image
+    input_image.draft(None, wanted)  # does nothing unless this is a JPEG
+    factor = min(input_image.width // wanted[0],
+                 input_image.height // wanted[1])
+    trace(2, 'Intermediate: drafted to {}, reducing by {}',
+          input_image.size, factor)
+    if factor < 2:
+        return input_image
+    try:
+        return input_image.reduce(factor)
+    except ValueError:  # modes like "P" and "1" cannot be reduced
+        return input_image
+
+
 def onefile(infile, outdir, img_sizes):
     """
     Iterate over the target image sizes that we want to create and resize and
-    pad them accordingly.
+    pad them accordingly. The input image is decoded once and all of the
+    thumbnails are derived from the intermediate image made by
+    make_intermediate. Thumbnails with the same geometry and background (like
+    "ev-l", "m-t", "n-t" and "v-t") are only computed once.
+
+    :return: a list of (key, thumbnail file name, thumbnail description,
+             thumbnail size, thumbnail size with Pillow defaults) for the
+             files written. The last is zero unless --report is set.
+             OSError is raised if the input file cannot be read or an output
+             file cannot be written.
     """
-    global image_mode
     basename = os.path.basename(infile)  # 'a/b/xyz.jpg' -> 'xyz.jpg'
     front, extension = os.path.splitext(basename)  # 'xyz.jpg' -> 'xyz', '.jpg'
-    if extension.lower() in ('.jpg', '.jpeg'):
-        image_mode = IMAGE_MODE_RGB
-    else:
-        image_mode = IMAGE_MODE_RGBA
+    _stage_times.clear()
+    with Image.open(infile) as input_image:
+        width, height = input_image.size
+        wh_ratio = width / height
+        alpha = has_alpha(input_image)
+        trace(2, "Input: {}\nSize (width, height) in pixels: {}, {}, "
+              "width/height = {:.3f}", infile, width, height, wh_ratio)
+        with timed('decode'):
+            intermediate = make_intermediate(input_image, img_sizes)
+            intermediate.load()
+        # (width, height, background, mode) -> padded image
+        thumbs = {}
+        written = []
+        for key in img_sizes:
+            img = img_sizes[key]
+            thumb_width, thumb_height, thumb_name, background, _ = img
+            profile = get_profile(img, extension)
+            image_mode = get_image_mode(extension, profile, alpha)
+            if _args.background:
+                background = _args.background
+            # 'FFFFFF' -> (255,255,255)
+            background_tuple = make_background_tuple(background)
+            trace(2, 'Background color: (0x{:02X}, 0x{:02X}, 0x{:02X})',
+                  *background_tuple)
+            target = (thumb_width, thumb_height, background_tuple, image_mode)
+            thumb_image = thumbs.get(target)
+            if thumb_image is None:
+                thumb_image = make_thumb(intermediate, wh_ratio, thumb_width,
+                                         thumb_height, background_tuple,
+                                         image_mode)
+                thumbs[target] = thumb_image
+            else:
+                trace(2, 'Reusing the {}x{} thumbnail', thumb_width,
+                      thumb_height)
+            thumb_file_name = (front + '_thumb_' + key +
+                               get_extension(profile, extension))
+            thumb_path = os.path.join(outdir, thumb_file_name)
+            with timed('save'):
+                save_thumb(thumb_image, thumb_path, profile)
+            nbytes = os.path.getsize(thumb_path)
+            nbytes_default = (default_size(thumb_image, extension)
+                              if _args.report else 0)
+            written.append((key, thumb_file_name, thumb_name, nbytes,
+                            nbytes_default))
+    return written
+
+
+def onefile_job(infile, outdir, img_sizes):
+    """
+    Wrapper around onefile that never raises so that it can be run in a
+    worker process. The result is reported by the main process.
+
+    :return: a 4-tuple of the input file, the list returned by onefile, an
+             error message which is None if the file was processed and a dict
+             of the seconds spent in each of STAGES.
+    """
+    try:
+        written = onefile(infile, outdir, img_sizes)
+        return infile, written, None, dict(_stage_times)
+    except FileNotFoundError:
+        return infile, [], 'Cannot find file', {}
+    except Exception as e:  # keep going with the other files in the batch
+        return infile, [], f'{type(e).__name__}: {e}', {}
+
+
+def init_worker(args, pool=False):
+    """
+    Initialize a worker process. With the "spawn" start method (the default
+    on macOS) the globals set in __main__ are not inherited. This is also
+    used by scripts that import this module. args must have the attributes
+    "verbose", "background", "profile", "quality", "report" and
+    "memlimit".
+
+    :param pool: if True, this is a process in a pool. Ctrl-C is then
+                 ignored; the main process shuts down the pool.
+    """
+    global _args
+    _args = args
+    if args.memlimit:
+        # The size of the decoded image is checked by limit_memory instead of
+        # Pillow refusing to open large images as decompression bombs. The
+        # JPEGs can then be opened and decoded at a reduced size.
+        Image.MAX_IMAGE_PIXELS = None
+    if pool:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def report(results):
+    """
+    Print the results of onefile_job in the order that the jobs were
+    submitted.
+
+    :param results: iterable of the tuples returned by onefile_job
+    :return: the number of jobs that failed
+    """
+    nfailed = 0
+    nbytes_total = nbytes_default_total = 0
+    for infile, written, error, _ in results:
+        if error:
+            nfailed += 1
+            print(f'{Fore.RED}{error}:', infile, Style.RESET_ALL,
+                  file=sys.stderr)
+            continue
+        for _, thumb_file_name, thumb_name, nbytes, nbytes_default in written:
+            trace(1, '  {}, ({})', thumb_file_name, thumb_name)
+            if _args.report:
+                trace(1, '      {:,} bytes, {:,} with Pillow defaults',
+                      nbytes, nbytes_default)
+            nbytes_total += nbytes
+            nbytes_default_total += nbytes_default
+    if _args.report and nbytes_default_total:
+        saved = nbytes_default_total - nbytes_total
+        print(f'Total {nbytes_total:,} bytes. Saved {saved:,} bytes '
+              f'({100 * saved / nbytes_default_total:.1f}%) compared with '
+              f'the Pillow defaults.')
+    return nfailed
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def thumb_spec(img):
+    """
+    :return: the list stored in the manifest describing how a thumbnail is
+             built, including the effect of --background.
+    """
+    width, height, name, background, profile = img
+    return [width, height, name, _args.background or background,
+            _args.profile or profile, _args.quality]
+
+
+def load_manifest(outdir):
+    """
+    The manifest is a dict keyed by the absolute path of the input file. Each
+    value is a dict containing:
+        size, mtime, sha256: describing the input file when it was processed
+        thumbs: dict keyed by the thumbnail key of dicts containing "spec",
+                see thumb_spec, and "file", the thumbnail file name.
+    """
+    path = os.path.join(outdir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
     try:
-        input_image = Image.open(infile)
-    except OSError:
-        print(f'{Fore.RED}Cannot find file:', infile, Style.RESET_ALL,
-              file=sys.stderr)
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        print(f'{Fore.YELLOW}Ignoring corrupt manifest:', path,
+              Style.RESET_ALL, file=sys.stderr)
+        return {}
+
+
+def save_manifest(outdir, manifest):
+    path = os.path.join(outdir, MANIFEST)
+    temppath = path + '.tmp'
+    with open(temppath, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temppath, path)
+
+
+def stale_imgs(manifest, infile, outdir, img_sizes):
+    """
+    :return: the subset of img_sizes that must be (re)built for infile. This
+             is all of them if the file is new or its content has changed,
+             otherwise only those whose spec has changed or whose thumbnail
+             is missing.
+    """
+    entry = manifest.get(os.path.abspath(infile))
+    if not entry:
+        return img_sizes
+    st = os.stat(infile)
+    if (st.st_size, st.st_mtime) != (entry['size'], entry['mtime']):
+        # The file has been touched. Only rebuild if the content changed.
+        if st.st_size != entry['size'] or file_hash(infile) != entry['sha256']:
+            return img_sizes
+        entry['mtime'] = st.st_mtime
+    thumbs = entry['thumbs']
+    stale = {}
+    for key, img in img_sizes.items():
+        thumb = thumbs.get(key)
+        if (not thumb or thumb['spec'] != thumb_spec(img) or
+                not os.path.exists(os.path.join(outdir, thumb['file']))):
+            stale[key] = img
+    return stale
+
+
+def update_manifest(manifest, img_sizes, results):
+    """
+    Record the successful results in the manifest as they are passed through
+    to report.
+    """
+    for infile, written, error, times in results:
+        if not error:
+            path = os.path.abspath(infile)
+            try:
+                st = os.stat(infile)
+                entry = manifest.get(path)
+                if (not entry or (st.st_size, st.st_mtime) !=
+                        (entry['size'], entry['mtime'])):
+                    entry = manifest[path] = dict(
+                        size=st.st_size, mtime=st.st_mtime,
+                        sha256=file_hash(infile), thumbs={})
+            except OSError as e:
+                # The file was moved or deleted after it was processed.
+                trace(1, 'Not recorded in the manifest: {}: {}', infile, e,
+                      color=Fore.YELLOW)
+                manifest.pop(path, None)
+            else:
+                for key, thumb_file_name, *_ in written:
+                    entry['thumbs'][key] = dict(
+                        spec=thumb_spec(img_sizes[key]), file=thumb_file_name)
+        yield infile, written, error, times
+
+
+def log_timings(results, timings, logfile=None):
+    """
+    Pass the results through to report, appending a record of the time
+    spent on each file to timings and writing it to logfile as a JSON line.
+    """
+    for infile, written, error, times in results:
+        if not error:
+            record = dict(file=infile, thumbs=len(written),
+                          total=round(sum(times.values()), 4),
+                          **{k: round(times.get(k, 0.), 4) for k in STAGES})
+            timings.append(record)
+            trace(2, 'Timing: {}', record)
+            if logfile:
+                print(json.dumps(record), file=logfile, flush=True)
+        yield infile, written, error, times
+
+
+def print_timings(timings):
+    """
+    Print the total time in each stage and a histogram of the time per file.
+    A batch dominated by "decode" and "save" is I/O and codec bound; one
+    dominated by "resize" is resample bound.
+    """
+    if not timings:
         return
-    width, height = input_image.size
-    wh_ratio = width / height
-    trace(2, "Input: {}\nSize (width, height) in pixels: {}, {}, "
-          "width/height = {:.3f}", infile, width, height, wh_ratio)
-    for key in img_sizes:
-        thumb_width, thumb_height, thumb_name, background = img_sizes[key]
-        if _args.background:
-            background = _args.background
-        # 'FFFFFF' -> (255,255,255)
-        background_tuple = make_background_tuple(background)
-        trace(2, 'Background color: (0x{:02X}, 0x{:02X}, 0x{:02X})',
-              *background_tuple)
-        thumb_wh_ratio = float(thumb_width) / float(thumb_height)
-        if wh_ratio > thumb_wh_ratio:
-            thumb_image = pad_height(input_image, thumb_width, thumb_height,
-                                     background_tuple)
-        else:
-            thumb_image = pad_width(input_image, thumb_width, thumb_height,
-                                    background_tuple)
-        thumb_file_name = front + '_thumb_' + key + extension
-        thumb_path = os.path.join(outdir, thumb_file_name)
-        trace(1, '  {}, ({})', thumb_file_name, thumb_name)
-        thumb_image.save(thumb_path)
+    total = sum(r['total'] for r in timings)
+    print(f'Timing for {len(timings)} files, {total:.3f} seconds:')
+    for stage in STAGES:
+        seconds = sum(r[stage] for r in timings)
+        print(f'    {stage:6} {seconds:9.3f}s {100 * seconds / total:5.1f}%')
+    counts = [0] * len(HISTOGRAM_BINS)
+    for r in timings:
+        counts[next(n for n, limit in enumerate(HISTOGRAM_BINS)
+                    if r['total'] < limit)] += 1
+    scale = min(1., 50 / max(counts))
+    print('Seconds per file:')
+    lower = 0
+    for limit, count in zip(HISTOGRAM_BINS, counts):
+        if count:
+            print(f'    {lower:>4}-{limit:<4} {count:5} '
+                  + '#' * max(1, round(count * scale)))
+        lower = limit
 
 
 def get_imgs(basekey):
@@ -173,29 +706,180 @@ def get_imgs(basekey):
     return wh
 
 
+def input_files(indir):
+    """
+    :return: list of the paths of the files in indir to make thumbnails of
+    """
+    infiles = []
+    for filename in os.listdir(indir):
+        # As in watch(). The dot-files include MANIFEST and its temporary
+        # file if the output directory is the input directory.
+        if '_thumb_' in filename or filename.startswith('.'):
+            continue
+        filepath = os.path.join(indir, filename)
+        if os.path.isdir(filepath):
+            continue
+        infiles.append(filepath)
+    return infiles
+
+
+def watch(args, wh, manifest):
+    """
+    Watch the input directory and make thumbnails of new and changed files
+    until interrupted. The files already in the directory are processed
+    first; the manifest skips those that are unchanged.
+
+    Events come from inotify if the inotify_simple package is installed,
+    otherwise the directory is polled every args.interval seconds. In either
+    case a file is only queued when its size and modification time have not
+    changed for args.settle seconds, so that files still being copied are
+    not read. At most two files per worker process are queued at a time.
+
+    :return: 0 when interrupted
+    """
+    inotify = None
+    if INotify and not args.poll:
+        inotify = INotify()
+        inotify.add_watch(args.infile, inotify_flags.CLOSE_WRITE |
+                          inotify_flags.MOVED_TO)
+    trace(1, 'Watching {} using {}. Press Ctrl-C to stop.', args.infile,
+          'inotify' if inotify else 'polling')
+    tick = min(args.settle, args.interval) / 2
+    seen = {}  # path -> (size, mtime) when last looked at
+    settling = {}  # path -> time when (size, mtime) last changed
+    running = {}  # Future -> path
+    timings = []
+    candidates = input_files(args.infile)
+    lastscan = time.monotonic()
+    logfile = open(args.timings_file, 'w') if args.timings_file else None
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                             initargs=(args, True)) as executor:
+        try:
+            while True:
+                now = time.monotonic()
+                for path in candidates + list(settling):
+                    name = os.path.basename(path)
+                    # Skip thumbnails like main does and hidden files, which
+                    # are often temporary files of the program copying in.
+                    if '_thumb_' in name or name.startswith('.'):
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        settling.pop(path, None)
+                        continue
+                    if not os.path.isfile(path):
+                        continue
+                    if seen.get(path) != (st.st_size, st.st_mtime):
+                        seen[path] = (st.st_size, st.st_mtime)
+                        settling[path] = now
+                    elif (path in settling and
+                          now - settling[path] >= args.settle and
+                          len(running) < 2 * args.jobs):
+                        del settling[path]
+                        stale = stale_imgs(manifest, path, args.outdir, wh)
+                        if stale:
+                            trace(2, 'Queued: {}', path)
+                            future = executor.submit(onefile_job, path,
+                                                     args.outdir, stale)
+                            running[future] = path
+                done = [f for f in running if f.done()]
+                if done:
+                    results = (f.result() for f in done)
+                    results = update_manifest(manifest, wh, results)
+                    report(log_timings(results, timings, logfile))
+                    save_manifest(args.outdir, manifest)
+                    for future in done:
+                        del running[future]
+                if inotify:
+                    events = inotify.read(timeout=int(tick * 1000))
+                    candidates = [os.path.join(args.infile, e.name)
+                                  for e in events if e.name]
+                else:
+                    time.sleep(tick)
+                    candidates = []
+                    if time.monotonic() - lastscan >= args.interval:
+                        candidates = input_files(args.infile)
+                        lastscan = time.monotonic()
+        except KeyboardInterrupt:
+            trace(1, 'Stopping, {} file{} in progress.', len(running),
+                  '' if len(running) == 1 else 's')
+            executor.shutdown(cancel_futures=True)
+        finally:
+            save_manifest(args.outdir, manifest)
+            if logfile:
+                logfile.close()
+    if args.timings or args.timings_file:
+        print_timings(timings)
+    return 0
+
+
 def main(args):
     os.makedirs(args.outdir, exist_ok=True)
     trace(1, "Output directory: {}", args.outdir)
     wh = THUMB_IMG_SIZES
     background = _args.background if _args.background else GREY
     if args.width:
-        wh = {'th': (args.width, args.height, 'anonymous', background)}
+        wh = {'th': Img(args.width, args.height, 'anonymous', background)}
     elif args.key:
         try:
             wh = get_imgs(args.key)
         except (ValueError, KeyError):
             print('Unrecognized key:', args.key)
-            return
+            return 1
+    manifest = {} if args.force else load_manifest(args.outdir)
+    if args.watch:
+        return watch(args, wh, manifest)
     if os.path.isdir(args.infile):
-        for filename in os.listdir(args.infile):
-            if '_thumb_' in filename:
-                continue
-            filepath = os.path.join(args.infile, filename)
-            if os.path.isdir(filepath):
-                continue
-            onefile(filepath, args.outdir, wh)
+        infiles = input_files(args.infile)
     else:
-        onefile(args.infile, args.outdir, wh)
+        infiles = [args.infile]
+    todo = {}  # the stale thumbnails of each input file
+    for infile in infiles:
+        if os.path.exists(infile):
+            todo[infile] = stale_imgs(manifest, infile, args.outdir, wh)
+            if not todo[infile]:
+                trace(2, 'Unchanged: {}', infile)
+                del todo[infile]
+        else:
+            todo[infile] = wh  # let onefile_job report the error
+    # Each job is the argument list for onefile_job. Splitting by key lets a
+    # small number of files be spread over more workers at the cost of
+    # decoding each input file once per key.
+    if args.perkey:
+        jobs = [(f, args.outdir, {k: todo[f][k]}) for f in todo
+                for k in todo[f]]
+    else:
+        jobs = [(f, args.outdir, todo[f]) for f in todo]
+    trace(1, '{} of {} input file{} to process.', len(todo), len(infiles),
+          '' if len(infiles) == 1 else 's')
+    timings = []
+    logfile = open(args.timings_file, 'w') if args.timings_file else None
+    try:
+        if args.jobs > 1 and len(jobs) > 1:
+            trace(2, 'Running {} jobs in {} processes', len(jobs), args.jobs)
+            with ProcessPoolExecutor(max_workers=args.jobs,
+                                     initializer=init_worker,
+                                     initargs=(args, True)) as executor:
+                results = executor.map(onefile_job, *zip(*jobs))
+                results = update_manifest(manifest, wh, results)
+                nfailed = report(log_timings(results, timings, logfile))
+        else:
+            results = (onefile_job(*job) for job in jobs)
+            results = update_manifest(manifest, wh, results)
+            nfailed = report(log_timings(results, timings, logfile))
+    finally:
+        # Also save the work done so far if interrupted.
+        save_manifest(args.outdir, manifest)
+        if logfile:
+            logfile.close()
+    if args.timings or args.timings_file:
+        print_timings(timings)
+    if nfailed:
+        print(f'{Fore.RED}{nfailed} of {len(jobs)} jobs failed.'
+              f'{Style.RESET_ALL}', file=sys.stderr)
+        return 1
+    return 0
 
 
 def get_args():
@@ -231,12 +915,32 @@ def get_args():
         will abort. The value can also be literal "white", "gold", or "grey"
         in which case values "FFFFFF", "AA915A", or "F2F4F6" will be
         substituted respectively.''')
+    parser.add_argument('--cprofile', help='''
+        Run under cProfile and write the statistics to this file. Only the
+        main process is profiled so this is most useful with --jobs 1. View
+        the file with "python -m pstats".
+        ''')
+    parser.add_argument('-f', '--force', action='store_true', help='''
+        Rebuild all of the thumbnails. Otherwise the manifest file "{}" in
+        the output directory is used to skip input files that have not
+        changed since their thumbnails were built with the same dimensions
+        and background.
+        '''.format(MANIFEST))
     parser.add_argument('--height', type=int, default=0, help='''
         Set an explicit height to pad to (sorry, -h is taken). You must also
         specify width. If specified, a single thumbnail file is created rather
         than the set of files internally defined. An abbreviation of 'th' is
         used for the output filename.
         ''')
+    parser.add_argument('--interval', type=float, default=5., help='''
+        With --watch, the number of seconds between scans of the directory
+        when polling. The default is 5.
+        ''')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='''
+        The number of worker processes to use when infile is a directory.
+        The default is 1, meaning process the files serially. Specify 0 to
+        use one process per CPU.
+        ''')
     parser.add_argument('-k', '--key', help='''Specifies a single thumbnail or
     a group of thumbnails
     to produce. A single thumbnail is specified by the key; the group is
@@ -244,14 +948,64 @@ def get_args():
      thumbnails for "ev-p" and
     "ev-l". Do not specify a key and also an explicit width and height.
     ''')
+    parser.add_argument('-m', '--memlimit', type=int, default=0, help='''
+        The maximum number of megabytes to use to decode an input file, per
+        process. Large JPEGs are decoded at a reduced size to fit, which may
+        reduce the quality of the thumbnails. Other files that would need more
+        are not processed. The default, 0, means no limit, but Pillow refuses
+        to open images of more than about 179 megapixels.
+        ''')
     parser.add_argument('-o', '--outdir', help='''Directory to contain the
         output thumbnail file. If omitted, the default is the directory
         "thumb" in the same directory that the input file resides. The
         directory is created if necessary.
         ''')
+    parser.add_argument('--perkey', action='store_true', help='''
+        If set with --jobs, each thumbnail of each file is a separate job
+        instead of each file being a job. This is useful when there are fewer
+        files than processes. The input file is read once per thumbnail.
+        ''')
+    parser.add_argument('--poll', action='store_true', help='''
+        With --watch, poll the directory even if inotify is available.
+        ''')
+    parser.add_argument('-p', '--profile', choices=sorted(ENCODER_PROFILES),
+                        help='''
+        The encoder profile to use for all of the thumbnails, overriding the
+        profile given in the table of thumbnails. If neither is given, the
+        profile for the type of the input file is used ("jpeg" or "png").
+        Other types of file are saved with the Pillow defaults. The webp and
+        avif profiles fall back to jpeg if Pillow does not support them.
+        ''')
+    parser.add_argument('-q', '--quality', type=int, help='''
+        Override the quality setting of the encoder profile. This is ignored
+        by profiles that have no quality setting, like png.
+        ''')
+    parser.add_argument('-r', '--report', action='store_true', help='''
+        Report the size of each thumbnail and the total bytes saved compared
+        with saving it in the input file's format with the Pillow defaults.
+        ''')
+    parser.add_argument('--settle', type=float, default=2., help='''
+        With --watch, the number of seconds that a file's size and
+        modification time must be unchanged before it is processed. The
+        default is 2.
+        ''')
+    parser.add_argument('-t', '--timings', action='store_true', help='''
+        Print the time spent decoding, resizing, padding and saving and a
+        histogram of the time taken per input file.
+        ''')
+    parser.add_argument('--timings-file', help='''
+        Write a JSON record of the time spent in each stage for each input
+        file to this file, one per line. Implies --timings.
+        ''')
     parser.add_argument('-v', '--verbose', type=int, default=1, help='''
         Set the verbosity. The default is 1 which prints summary information.
         ''')
+    parser.add_argument('--watch', action='store_true', help='''
+        Keep running and make thumbnails of files as they are added to or
+        changed in the input directory, which must be a directory. Uses
+        inotify on Linux if the inotify_simple package is installed,
+        otherwise the directory is polled. Stop with Ctrl-C.
+        ''')
     parser.add_argument('-w', '--width', type=int, default=0, help='''
         Set an explicit width to pad to. You must also specify height.
         ''')
@@ -260,6 +1014,8 @@ def get_args():
     if bool(args.height) != bool(args.width):
         raise ValueError('You must specify either both width and height or'
                          ' neither.')
+    if args.watch and not os.path.isdir(args.infile):
+        raise ValueError('With --watch, infile must be a directory.')
     if bool(args.key) and bool(args.height):
         raise ValueError('You may not specify both the key and also height'
                          + ' and width.')
@@ -269,6 +1025,8 @@ def get_args():
         else:
             args.outdir, _ = os.path.split(args.infile)
         args.outdir = os.path.join(args.outdir, 'thumb')
+    if args.jobs == 0:
+        args.jobs = os.cpu_count()
     if args.background:
         match args.background.lower():
             case 'white':
@@ -283,7 +1041,6 @@ def get_args():
 
 if __name__ == '__main__':
     assert sys.version_info >= (3, 6)
-    image_mode = None  # will be resolved in onefile()
     if len(sys.argv) == 1:
         sys.argv.append('-h')
     try:
@@ -291,4 +1048,10 @@ if __name__ == '__main__':
     except ValueError as v:
         print(v)
         sys.exit(1)
-    main(_args)
+    init_worker(_args)
+    if _args.cprofile:
+        profiler = cProfile.Profile()
+        rc = profiler.runcall(main, _args)
+        profiler.dump_stats(_args.cprofile)
+        sys.exit(rc)
+    sys.exit(main(_args))
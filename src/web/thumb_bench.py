@@ -0,0 +1,221 @@
+"""
+    Benchmark thumb.py.
+
+    A reproducible corpus of synthetic images is created in the corpus
+    directory if it is not already there. Each image is a combination of an
+    aspect ratio, a size in megapixels and a type (JPEG, RGB PNG or RGBA PNG).
+    For each image, thumb.onefile is run for all of the keys in
+    THUMB_IMG_SIZES and the time of each stage (decode, resize, pad and save)
+    is taken from thumb.py's timing hooks.
+
+    The results are printed and can also be written as JSON to compare one
+    version of thumb.py with another.
+"""
+
+import argparse
+from colorama import Style
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import PIL
+from PIL import Image
+
+import thumb
+
+ASPECTS = ('3:2', '2:3', '1:1')
+MEGAPIXELS = (1, 10, 50)
+# name: (Image mode, file extension)
+KINDS = {'jpeg': ('RGB', '.jpg'), 'png': ('RGB', '.png'),
+         'rgba': ('RGBA', '.png')}
+
+
+def trace(level, template, *args, color=None):
+    if _args.verbose >= level:
+        if color:
+            print(f'{color}{template.format(*args)}{Style.RESET_ALL}')
+        else:
+            print(template.format(*args))
+
+
+def make_image(width, height, mode, rng):
+    """
+    :return: an image with gradients and noise so that it neither compresses
+             to nothing nor is pure noise, which would be unlike a scan.
+    """
+    x = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    tile = rng.integers(0, 16, (256, 256), dtype=np.uint8)
+    reps = (math.ceil(height / 256), math.ceil(width / 256))
+    noise = np.tile(tile, reps)[:height, :width]
+    # Clip rather than let values over 255 wrap round to hard edges.
+    bands = [np.clip(x + noise, 0, 255).astype(np.uint8) +
+             np.zeros_like(noise),
+             np.clip(y + noise, 0, 255).astype(np.uint8),
+             np.clip((x + y) / 2 + noise, 0, 255).astype(np.uint8)]
+    if mode == 'RGBA':
+        # opaque in the middle, fading to transparent at the left and right
+        alpha = (255 - np.abs(x - 127.5) * 2).astype(np.uint8)
+        bands.append(alpha + np.zeros_like(noise))
+    return Image.fromarray(np.dstack(bands), mode)
+
+
+def make_corpus(corpusdir):
+    """
+    Create the corpus images that are not already in corpusdir.
+
+    :return: list of paths of the images
+    """
+    os.makedirs(corpusdir, exist_ok=True)
+    paths = []
+    for aspect in _args.aspects:
+        aw, ah = (int(n) for n in aspect.split(':'))
+        for megapixels in _args.megapixels:
+            width = round(math.sqrt(megapixels * 1e6 * aw / ah))
+            height = round(megapixels * 1e6 / width)
+            for kind in _args.kinds:
+                mode, extension = KINDS[kind]
+                name = f'{kind}_{aw}x{ah}_{megapixels}mp{extension}'
+                path = os.path.join(corpusdir, name)
+                paths.append(path)
+                if os.path.exists(path):
+                    continue
+                trace(1, 'Creating {} ({}x{})', name, width, height)
+                # The seed depends on the image so that each image is the
+                # same whichever subset of the corpus is created.
+                rng = np.random.default_rng([_args.seed, aw, ah, megapixels])
+                img = make_image(width, height, mode, rng)
+                img.save(path, quality=90, compress_level=1)
+    return paths
+
+
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes.
+    return maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def bench_one(path, outdir):
+    """
+    :return: dict of the results for one corpus image
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+        mode = img.mode
+    best = stages = None
+    for _ in range(_args.repeat):
+        t = time.perf_counter()
+        _, _, error, times = thumb.onefile_job(path, outdir,
+                                               thumb.THUMB_IMG_SIZES)
+        elapsed = time.perf_counter() - t
+        if error:
+            raise RuntimeError(f'{path}: {error}')
+        if best is None or elapsed < best:
+            best, stages = elapsed, times
+    return dict(file=os.path.basename(path), width=width, height=height,
+                mode=mode, megapixels=round(width * height / 1e6, 1),
+                onefile=round(best, 4),
+                stages={k: round(stages.get(k, 0.), 4) for k in thumb.STAGES})
+
+
+def init_worker(args):
+    global _args
+    _args = args
+
+
+def main():
+    # Create the corpus in another process so that the memory used to create
+    # it is not in the peak RSS, which would then depend on whether the
+    # corpus already existed.
+    with ProcessPoolExecutor(max_workers=1, initializer=init_worker,
+                             initargs=(_args,)) as executor:
+        paths = executor.submit(make_corpus, _args.corpus).result()
+    results = []
+    t1 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as outdir:
+        for path in paths:
+            result = bench_one(path, outdir)
+            results.append(result)
+            trace(1, '{:26} {:5.1f} MP  onefile {:7.3f}s  {}', result['file'],
+                  result['megapixels'], result['onefile'],
+                  '  '.join(f'{k} {v:7.3f}s' for k, v in
+                            result['stages'].items()))
+    elapsed = time.perf_counter() - t1
+    total = sum(r['onefile'] for r in results)
+    summary = dict(
+        images=len(results),
+        images_per_second=round(len(results) / total, 3),
+        stages={stage: round(sum(r['stages'][stage] for r in results), 4)
+                for stage in results[0]['stages']},
+        peak_rss_mb=round(peak_rss_mb(), 1),
+        elapsed=round(elapsed, 2))
+    trace(1, 'Images/sec: {}, peak RSS: {} MB', summary['images_per_second'],
+          summary['peak_rss_mb'])
+    trace(1, 'Stage totals: ' + ', '.join(f'{k} {v:.3f}s' for k, v in
+                                          summary['stages'].items()))
+    if _args.json:
+        report = dict(python=platform.python_version(),
+                      pillow=PIL.__version__,
+                      platform=platform.platform(),
+                      settings=dict(seed=_args.seed, repeat=_args.repeat,
+                                    profile=_args.profile),
+                      summary=summary, results=results)
+        with open(_args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        trace(1, 'Written: {}', _args.json)
+    return 0
+
+
+def getargs():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument('corpus', help='''
+    The directory to contain the synthetic images. Images already there are
+    reused.''')
+    parser.add_argument('--aspects', nargs='+', default=ASPECTS, help=f'''
+    The aspect ratios of the images as W:H. The default is
+    {' '.join(ASPECTS)}.''')
+    parser.add_argument('-j', '--json', help='''
+    File to write the results to as JSON.''')
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=KINDS,
+                        help='''
+    The types of image to create. The default is all of them.''')
+    parser.add_argument('--megapixels', nargs='+', type=int,
+                        default=MEGAPIXELS, help=f'''
+    The sizes of the images. The default is
+    {' '.join(str(n) for n in MEGAPIXELS)}.''')
+    parser.add_argument('-p', '--profile',
+                        choices=sorted(thumb.ENCODER_PROFILES), help='''
+    The encoder profile, see thumb.py.''')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='''
+    The number of times to run onefile for each image. The best time is
+    reported.''')
+    parser.add_argument('--seed', type=int, default=1, help='''
+    The random seed used to create the corpus.''')
+    parser.add_argument('-v', '--verbose', type=int, default=1, help='''
+    Set the verbosity. The default is 1 which prints summary information.''')
+    args = parser.parse_args()
+    # used by the thumb module, see thumb.init_worker
+    args.background = args.quality = None
+    args.report = False
+    args.memlimit = 0
+    return args
+
+
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 9)
+    if len(sys.argv) == 1:
+        sys.argv.append('-h')
+    _args = getargs()
+    # The thumb module's own messages would swamp the results.
+    thumb.init_worker(argparse.Namespace(**{**vars(_args),
+                                            'verbose': _args.verbose - 1}))
+    sys.exit(main())
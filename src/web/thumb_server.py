@@ -0,0 +1,322 @@
+"""
+    Serve thumbnail images on demand.
+
+    GET /thumb/<key>/<path> returns the thumbnail for <key> (see thumb.py for
+    the list of keys) of the image <path> relative to the root directory.
+    HEAD returns the same headers without the thumbnail.
+
+    Rendered thumbnails are kept in an in-memory LRU cache and in an on-disk
+    cache directory. The ETag is derived from the content of the source image
+    and the thumbnail specification so clients can use conditional GETs.
+    Rendering is done in a bounded pool of worker processes, which is
+    restarted if a worker dies.
+"""
+
+import argparse
+from collections import OrderedDict
+from colorama import Fore, Style
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import mimetypes
+import os
+import sys
+import threading
+from urllib.parse import unquote, urlsplit
+
+from PIL import Image
+
+import thumb
+
+URLPREFIX = '/thumb/'
+
+
+def trace(level, template, *args, color=None):
+    if _args.verbose >= level:
+        if color:
+            print(f'{color}{template.format(*args)}{Style.RESET_ALL}')
+        else:
+            print(template.format(*args))
+
+
+def render(path, key):
+    """
+    Run in a worker process.
+
+    :return: the encoded bytes of the thumbnail of the image at path
+    """
+    img = thumb.THUMB_IMG_SIZES[key]
+    thumb_width, thumb_height, _, background, _ = img
+    extension = os.path.splitext(path)[1]
+    profile = thumb.get_profile(img, extension)
+    with Image.open(path) as input_image:
+        image_format = input_image.format
+        width, height = input_image.size
+        intermediate = thumb.make_intermediate(input_image, {key: img})
+        thumb_image = thumb.make_thumb(intermediate, width / height,
+                                       thumb_width, thumb_height,
+                                       thumb.make_background_tuple(background),
+                                       thumb.get_image_mode(
+                                           extension, profile,
+                                           thumb.has_alpha(input_image)))
+    buf = io.BytesIO()
+    thumb.save_thumb(thumb_image, buf, profile, image_format)
+    return buf.getvalue()
+
+
+def thumb_extension(path, key):
+    """
+    :return: the extension of the thumbnail, which determines its
+             Content-Type
+    """
+    extension = os.path.splitext(path)[1]
+    profile = thumb.get_profile(thumb.THUMB_IMG_SIZES[key], extension)
+    return thumb.get_extension(profile, extension).lower()
+
+
+class LRUCache:
+    """
+    A thread-safe cache of bytes values limited by the total size of the
+    values.
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.maxbytes:
+            return
+        with self.lock:
+            if key in self.data:
+                self.nbytes -= len(self.data.pop(key))
+            self.data[key] = value
+            self.nbytes += len(value)
+            while self.nbytes > self.maxbytes:
+                _, old = self.data.popitem(last=False)
+                self.nbytes -= len(old)
+
+
+class ThumbServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, args):
+        super().__init__(address, ThumbHandler)
+        self.root = os.path.realpath(args.root)
+        self.cachedir = args.cachedir
+        self.memcache = LRUCache(args.memcache * 1024 * 1024)
+        self.args = args
+        self.executor = self.new_pool()
+        self.lock = threading.Lock()
+        self.hashes = {}  # path -> (size, mtime, sha256)
+        # etag -> (Future, the pool running it), so concurrent requests
+        # share it
+        self.pending = {}
+
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.args.workers,
+                                   initializer=thumb.init_worker,
+                                   initargs=(self.args, True))
+
+    def restart_pool(self, broken):
+        """
+        Replace the pool if a worker died, for example killed for using too
+        much memory, unless another thread has already replaced it.
+        """
+        with self.lock:
+            if self.executor is not broken:
+                return
+            trace(0, 'A worker process died. Restarting the pool.',
+                  color=Fore.RED)
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.new_pool()
+
+    def render(self, path, key, etag):
+        """
+        Render in the worker pool. If the pool is broken, restart it and try
+        once more.
+
+        :return: the thumbnail bytes
+        """
+        for attempt in range(2):
+            with self.lock:
+                future, executor = self.pending.get(etag, (None, None))
+                if future is None:
+                    executor = self.executor
+                    try:
+                        future = executor.submit(render, path, key)
+                    except BrokenProcessPool as e:
+                        future = Future()
+                        future.set_exception(e)
+                    self.pending[etag] = future, executor
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                self.restart_pool(executor)
+            finally:
+                with self.lock:
+                    if self.pending.get(etag, (None,))[0] is future:
+                        del self.pending[etag]
+
+    def source_hash(self, path):
+        st = os.stat(path)
+        with self.lock:
+            cached = self.hashes.get(path)
+        if cached and cached[:2] == (st.st_size, st.st_mtime):
+            return cached[2]
+        sha256 = thumb.file_hash(path)
+        with self.lock:
+            self.hashes[path] = (st.st_size, st.st_mtime, sha256)
+        return sha256
+
+    def get_thumb(self, path, key, etag):
+        """
+        :return: the thumbnail bytes from the memory cache, the disk cache or
+                 by rendering it in the worker pool.
+        """
+        data = self.memcache.get(etag)
+        if data is not None:
+            trace(2, 'memory cache hit: {}', etag)
+            return data
+        cachepath = os.path.join(self.cachedir,
+                                 etag + thumb_extension(path, key))
+        if os.path.exists(cachepath):
+            trace(2, 'disk cache hit: {}', cachepath)
+            with open(cachepath, 'rb') as f:
+                data = f.read()
+        else:
+            data = self.render(path, key, etag)
+            temppath = f'{cachepath}.{threading.get_ident()}.tmp'
+            with open(temppath, 'wb') as f:
+                f.write(data)
+            os.replace(temppath, cachepath)
+            trace(1, 'rendered: {} {}', key, path)
+        self.memcache.put(etag, data)
+        return data
+
+
+class ThumbHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_thumb(True)
+
+    def do_HEAD(self):
+        self.send_thumb(False)
+
+    def send_thumb(self, send_body):
+        """
+        Send the headers of the thumbnail and, if send_body, the thumbnail.
+        send_error omits the body of an error response to a HEAD request.
+        """
+        urlpath = unquote(urlsplit(self.path).path)
+        if not urlpath.startswith(URLPREFIX):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        key, _, relpath = urlpath[len(URLPREFIX):].partition('/')
+        if key not in thumb.THUMB_IMG_SIZES:
+            self.send_error(HTTPStatus.NOT_FOUND, f'Unknown key: {key}')
+            return
+        root = self.server.root
+        path = os.path.realpath(os.path.join(root, relpath))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        spec = json.dumps(thumb.THUMB_IMG_SIZES[key])
+        etag = hashlib.sha256((self.server.source_hash(path) + spec)
+                              .encode()).hexdigest()[:32]
+        if etag in (t.strip(' "') for t in
+                    self.headers.get('If-None-Match', '').split(',')):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', f'"{etag}"')
+            self.end_headers()
+            return
+        try:
+            data = self.server.get_thumb(path, key, etag)
+        except Exception as e:  # a bad image must not stop the server
+            trace(0, 'Cannot render {}: {}', path, e, color=Fore.RED)
+            self.send_error(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+            return
+        ctype = (mimetypes.guess_type('x' + thumb_extension(path, key))[0]
+                 or 'application/octet-stream')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', f'"{etag}"')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def log_message(self, template, *args):
+        trace(2, '{} {}', self.address_string(), template % args)
+
+
+def getargs():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument('root', help='''
+    The directory containing the source images. Paths in URLs are relative
+    to this directory.''')
+    parser.add_argument('--cachedir', help='''
+    The directory to contain the rendered thumbnails. The default is
+    ".thumbcache" in the root directory. It is created if necessary.''')
+    parser.add_argument('--host', default='127.0.0.1', help='''
+    The address to listen on. The default is 127.0.0.1.''')
+    parser.add_argument('--memcache', type=int, default=64, help='''
+    The size of the in-memory cache in megabytes. The default is 64.''')
+    parser.add_argument('-m', '--memlimit', type=int, default=0, help='''
+    The maximum number of megabytes each worker may use to decode an image.
+    See thumb.py. The default, 0, means no limit.''')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='''
+    The port to listen on. The default is 8000.''')
+    parser.add_argument('-v', '--verbose', type=int, default=1, help='''
+    Set the verbosity. The default is 1 which prints summary information.''')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='''
+    The number of worker processes that render thumbnails. The default is
+    the number of CPUs.''')
+    args = parser.parse_args()
+    if not args.cachedir:
+        args.cachedir = os.path.join(args.root, '.thumbcache')
+    # used by the thumb module, see thumb.init_worker
+    args.background = args.profile = args.quality = None
+    args.report = False
+    return args
+
+
+def main():
+    os.makedirs(_args.cachedir, exist_ok=True)
+    server = ThumbServer((_args.host, _args.port), _args)
+    trace(1, 'Serving {} on http://{}:{}{}<key>/<path>', server.root,
+          _args.host, _args.port, URLPREFIX)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+    return 0
+
+
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 9)
+    if len(sys.argv) == 1:
+        sys.argv.append('-h')
+    _args = getargs()
+    thumb.init_worker(_args)
+    sys.exit(main())
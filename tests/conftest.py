@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The scripts import their sibling modules by name, as when run from their
+# own directories.
+SRC = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+for subdir in ('', 'tickets', 'web'):
+    sys.path.insert(0, os.path.join(SRC, subdir))
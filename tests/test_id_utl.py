@@ -0,0 +1,50 @@
+import math
+import pickle
+
+import pandas as pd
+import pytest
+
+import id_utl
+from id_utl import IdIndex, IdRange, expand_idnums, parse_idnum
+
+
+def test_expand_idnums_coerces_nan():
+    got = expand_idnums(['JB1-2', math.nan, None, 'JB3'], errors='coerce')
+    assert got == [['JB1', 'JB2'], None, None, ['JB3']]
+
+
+def test_expand_idnums_raises_on_nan():
+    with pytest.raises(TypeError, match='nan'):
+        expand_idnums(['JB1', math.nan])
+
+
+def test_idrange_is_a_4_tuple():
+    ranges = parse_idnum('JB001-010,JB20')
+    assert [r.count for r in ranges] == [10, 1]
+    assert pd.DataFrame(ranges).shape == (2, 4)
+    wide = IdRange('JB', 0, 10 ** 12, 12)
+    assert wide.count == 10 ** 12 + 1
+    assert len(wide) == 4
+    assert pickle.loads(pickle.dumps(wide)) == wide
+    assert wide._make(tuple(wide)) == wide
+
+
+def test_index_lookup_with_wide_covering_range(monkeypatch):
+    ranges = [IdRange('JB', n, n + 2, 6) for n in range(0, 300000, 10)]
+    wide = IdRange('JB', 0, 999999, 6)
+    index = IdIndex([(wide, 'wide')] + [(r, r.start) for r in ranges])
+    assert index.lookup('JB150001') == ['wide', 150000]
+    assert index.lookup('JB150005') == ['wide']
+    assert index.lookup('JB999999') == ['wide']
+    assert [r.start for r, _ in index.overlapping('JB000009-21')] == [
+        0, 10, 20]
+    calls = []
+    original = id_utl._shares_id
+
+    def shares_id(a, b):
+        calls.append(a)
+        return original(a, b)
+    monkeypatch.setattr(id_utl, '_shares_id', shares_id)
+    index.lookup('JB250001')
+    # A bisection, not a scan back over the 25,000 ranges after the wide one
+    assert len(calls) < 100
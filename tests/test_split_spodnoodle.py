@@ -0,0 +1,29 @@
+import cv2 as cv
+import numpy as np
+
+import split_spodnoodle
+
+
+def test_truncated_jpeg_has_no_geometry(tmp_path):
+    img = np.full((48, 64, 3), 128, np.uint8)
+    ok, buf = cv.imencode('.jpg', img)
+    data = buf.tobytes()
+    path = tmp_path / 'JB1.jpg'
+    path.write_bytes(data)
+    assert split_spodnoodle.jpeg_geometry(str(path)) == (64, 48, 16, 16)
+    sof = data.index(b'\xff\xc0')
+    # Cut off in the markers before the frame, in its length and in its
+    # components.
+    for size in (3, 5, sof + 1, sof + 3, sof + 9, sof + 12):
+        path.write_bytes(data[:size])
+        assert split_spodnoodle.jpeg_geometry(str(path)) is None, size
+
+
+def test_split_error_fails_only_that_image(monkeypatch):
+    def split_image(filename, files):
+        raise MemoryError()
+    monkeypatch.setattr(split_spodnoodle, 'split_image', split_image)
+    filename, n, error = split_spodnoodle.split_file('JB1&2#1.jpg',
+                                                     ['JB1#1', 'JB2#1'])
+    assert n == 0
+    assert 'MemoryError' in error
@@ -0,0 +1,52 @@
+import argparse
+
+import cv2 as cv
+import numpy as np
+
+import stitch_spodnoodle
+
+
+def make_args(indir, outdir):
+    return argparse.Namespace(indir=str(indir), outdir=str(outdir),
+                              flagchar=None, threads=None, offset=None,
+                              fastpath=0, mode=cv.Stitcher_SCANS,
+                              registration=None, seam=None, compositing=None,
+                              verbose=1)
+
+
+def test_zero_byte_scan_is_unreadable(tmp_path):
+    img = np.full((64, 64, 3), 128, np.uint8)
+    cv.imwrite(str(tmp_path / 'JB1A.jpg'), img)
+    (tmp_path / 'JB1B.jpg').write_bytes(b'')
+    stitch_spodnoodle.init_worker(make_args(tmp_path, tmp_path))
+    outfile, status, message, record = stitch_spodnoodle.stitch_file(
+        'JB1.jpg', ['JB1A.jpg', 'JB1B.jpg'])
+    assert status == stitch_spodnoodle.FAILED
+    assert record['error'] == 'unreadable'
+    assert record['inputs'][1]['size'] == 0
+    assert 'JB1B.jpg' in message
+
+
+def test_stitch_error_fails_only_that_set(tmp_path, monkeypatch):
+    img = np.full((64, 64, 3), 128, np.uint8)
+    for name in ('JB1A.jpg', 'JB1B.jpg'):
+        cv.imwrite(str(tmp_path / name), img)
+    stitch_spodnoodle.init_worker(make_args(tmp_path, tmp_path))
+
+    def stitch_parts(outfile, imgs):
+        raise cv.error('out of memory')
+    monkeypatch.setattr(stitch_spodnoodle, 'stitch_parts', stitch_parts)
+    outfile, status, message, record = stitch_spodnoodle.stitch_file(
+        'JB1.jpg', ['JB1A.jpg', 'JB1B.jpg'])
+    assert status == stitch_spodnoodle.FAILED
+    assert record['error'].startswith('error: ')
+    assert len(record['inputs']) == 2
+
+
+def test_missing_scan_fails_the_set(tmp_path):
+    cv.imwrite(str(tmp_path / 'JB1A.jpg'), np.zeros((8, 8, 3), np.uint8))
+    stitch_spodnoodle.init_worker(make_args(tmp_path, tmp_path))
+    outfile, status, message, record = stitch_spodnoodle.stitch_file(
+        'JB1.jpg', ['JB1A.jpg', 'JB1B.jpg'])
+    assert status == stitch_spodnoodle.FAILED
+    assert record['error'].startswith('FileNotFoundError')
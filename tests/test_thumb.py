@@ -0,0 +1,24 @@
+import pytest
+
+import thumb
+
+
+@pytest.mark.parametrize('profile, extension, expected', [
+    ('jpeg', '.JPG', '.JPG'),
+    ('jpeg', '.jpeg', '.jpeg'),
+    ('jpeg', '.png', '.jpg'),
+    ('png', '.bmp', '.png'),
+    ('webp', '.gif', '.webp'),
+    ('avif', '.tif', '.avif'),
+    (None, '.gif', '.gif'),
+])
+def test_get_extension(profile, extension, expected):
+    assert thumb.get_extension(profile, extension) == expected
+
+
+def test_input_files_skips_thumbs_and_dot_files(tmp_path):
+    for name in ('a.jpg', 'a_thumb_ev-l.jpg', thumb.MANIFEST,
+                 thumb.MANIFEST + '.tmp', '.DS_Store'):
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'sub').mkdir()
+    assert thumb.input_files(str(tmp_path)) == [str(tmp_path / 'a.jpg')]
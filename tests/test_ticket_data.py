@@ -0,0 +1,27 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+import ticket_data
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.mark.parametrize('extension', ticket_data.CACHE_EXTS)
+def test_cache_range_without_date_column(tmp_path, extension):
+    df = pd.DataFrame({
+        'date': pd.to_datetime(['2024-02-29', '2024-03-01', '2024-03-31',
+                                '2024-04-01']),
+        'quantity': [1, 2, 3, 4],
+        'type': ['Adult', 'Child', 'Adult', 'Child'],
+        'totprice': [7.5, 0., 15., 0.],
+    })
+    path = str(tmp_path / ('tickets' + extension))
+    ticket_data.save(df, path)
+    start, end = ticket_data.month_range(2024, 3)
+    got = ticket_data.load(path, columns=('quantity', 'totprice'),
+                           start=start, end=end)
+    assert list(got.columns) == ['quantity', 'totprice']
+    assert got.quantity.tolist() == [2, 3]
+    assert got.totprice.tolist() == [0., 15.]